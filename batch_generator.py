@@ -0,0 +1,57 @@
+import sys
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
+
+from rate_limiter import share_provider_limits
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+WORKSPACES_DIR = os.path.join(ROOT_DIR, 'workspaces')
+
+# One video per job. Each job runs in its own workspace (workspaces/<name>), which may hold its own
+# handles.txt, *_context.txt files, data/youtube_credentials.json and token.pickle.
+JOBS = [
+    {"name": "video_1", "handles_file": "handles.txt"},
+    {"name": "video_2", "handles_file": "handles.txt"},
+]
+MAX_PROCESSES = 2
+
+def init_worker(processes):
+    # Every process has its own rate limiters, so each one gets an equal share of the provider limits
+    share_provider_limits(processes)
+
+def produce_video(job):
+    """
+    Run the whole pipeline for one job in its own workspace.
+    :return: The job name and None on success, or the error message on failure
+    """
+    import video_generator
+
+    workspace_dir = os.path.join(WORKSPACES_DIR, job["name"])
+    os.makedirs(workspace_dir, exist_ok=True)
+
+    handles_file = job.get("handles_file")
+    if handles_file and not os.path.isabs(handles_file):
+        # Prefer the workspace's own handles file over the shared one
+        workspace_handles = os.path.join(workspace_dir, handles_file)
+        handles_file = workspace_handles if os.path.exists(workspace_handles) else os.path.join(ROOT_DIR, handles_file)
+
+    try:
+        video_generator.run_pipeline(workspace_dir, handles_file)
+    except Exception:
+        return job["name"], traceback.format_exc()
+    return job["name"], None
+
+if __name__ == "__main__":
+    processes = min(MAX_PROCESSES, len(JOBS))
+    print(f"***** Producing {len(JOBS)} video(s) with {processes} process(es)... *****")
+
+    with ProcessPoolExecutor(max_workers=processes, initializer=init_worker, initargs=(processes,)) as executor:
+        results = list(executor.map(produce_video, JOBS))
+
+    for name, error in results:
+        if error:
+            print(f"\n{name}: failed\n{error}")
+        else:
+            print(f"{name}: completed")
@@ -0,0 +1,84 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+
+class AudioCache:
+    def __init__(self, enabled=True, cache_dir=None):
+        """
+        Content-addressed store of synthesized narration.
+        :param enabled: Set to False to always re-synthesize
+        :param cache_dir: Directory holding the cached audio files and their durations
+        """
+        self.enabled = enabled
+        self.cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tmp', 'cache', 'audio')
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def make_key(self, ssml_text, voice_name, language_code, gender, encoding):
+        """
+        Hash every input that changes the synthesized audio into a cache key.
+        """
+        payload = json.dumps([ssml_text, voice_name, language_code, gender, encoding])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def fetch(self, key, output_path, extension="mp3"):
+        """
+        Place the cached audio for key at output_path.
+        :return: The recorded duration in seconds, or None when the audio is not cached
+        """
+        if not self.enabled:
+            return None
+
+        audio_path = os.path.join(self.cache_dir, f"{key}.{extension}")
+        duration_path = os.path.join(self.cache_dir, f"{key}.json")
+
+        try:
+            with open(duration_path, "r") as file:
+                duration = json.load(file)["duration"]
+        except (OSError, ValueError, KeyError):
+            duration = None
+
+        if duration is None or not os.path.exists(audio_path):
+            with self.lock:
+                self.misses += 1
+            return None
+
+        self.link_or_copy(audio_path, output_path)
+        with self.lock:
+            self.hits += 1
+        return duration
+
+    def store(self, key, output_path, duration, extension="mp3"):
+        """
+        Add a freshly synthesized file to the cache, with its duration next to it.
+        """
+        if not self.enabled:
+            return
+
+        audio_path = os.path.join(self.cache_dir, f"{key}.{extension}")
+        duration_path = os.path.join(self.cache_dir, f"{key}.json")
+
+        self.link_or_copy(output_path, audio_path)
+
+        tmp_path = f"{duration_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump({"duration": duration}, file)
+        os.replace(tmp_path, duration_path)
+
+    @staticmethod
+    def link_or_copy(src, dst):
+        # Never write through an existing hard link, that would change the cached copy as well
+        if os.path.exists(dst):
+            os.remove(dst)
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copyfile(src, dst)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
@@ -1,14 +1,23 @@
 import os
+import re
 import warnings
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
 from google.cloud import texttospeech
 from dotenv import load_dotenv
 from langchain_community.chat_models import ChatOpenAI
 from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
-from pydub import AudioSegment
+from llm_cache import LLMCache
+from audio_cache import AudioCache
+from mp3_duration import get_mp3_duration
+from rate_limiter import get_rate_limiter
+from metrics import metrics
+from tracing import tracer
+from run_manifest import get_run_manifest
 
 class AudioGenerator:
-    def __init__(self, language_code="en-US", voice_name="en-US-Neural2-I", gender="MALE"):
+    def __init__(self, language_code="en-US", voice_name="en-US-Neural2-I", gender="MALE", max_workers=4, use_llm_cache=True, use_audio_cache=True, batch_ssml=False, manifest=None, workspace_dir=None):
         warnings.filterwarnings("ignore")
 
         env_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.env')
@@ -17,11 +26,18 @@ class AudioGenerator:
         self.language_code = language_code
         self.voice_name = voice_name
         self.gender = gender
+        self.max_workers = max_workers  # Paragraphs narrated concurrently; 1 keeps the old serial behaviour
+        self.batch_ssml = batch_ssml  # One SSML request per section instead of per paragraph
         self.client = texttospeech.TextToSpeechClient()
 
         self.llm = ChatOpenAI(temperature=0.7, model="gpt-4")
+        self.llm_cache = LLMCache(stage="audio", enabled=use_llm_cache)
+        self.audio_cache = AudioCache(enabled=use_audio_cache)
+        self.workspace_dir = workspace_dir or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+        self.manifest = manifest or get_run_manifest(os.path.join(self.workspace_dir, 'tmp', 'manifest.json'))  # Paragraphs narrated by an interrupted run are skipped
         
-        self.audio_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tmp', 'audios')
+        self.paragraphs_dir = os.path.join(self.workspace_dir, 'tmp', 'paragraphs')
+        self.audio_dir = os.path.join(self.workspace_dir, 'tmp', 'audios')
         os.makedirs(self.audio_dir, exist_ok=True)
 
     def get_ssml_text(self, paragraph_text):
@@ -34,7 +50,7 @@ class AudioGenerator:
         """
         prompt = PromptTemplate(input_variables=["paragraph_text"], template=prompt_template)
         chain = LLMChain(llm=self.llm, prompt=prompt)
-        ssml_text = chain.run(paragraph_text)
+        ssml_text = self.llm_cache.run(chain, {"paragraph_text": paragraph_text})
 
         if ssml_text.strip():
             return ssml_text
@@ -42,10 +58,114 @@ class AudioGenerator:
             print(f"Warning: SSML for paragraph is empty.")
             return None
 
+    def get_ssml_texts(self, paragraphs):
+        """
+        Generate SSML for all paragraphs of a section in a single request.
+        Paragraphs whose SSML is missing or not well-formed are requested again one by one.
+        """
+        prompt_template = """
+        Generate high-quality SSML for each of the following paragraphs. Use SSML tags such as <break>, <prosody>, <emphasis>, etc., to add pauses and tone variation.
+        Write every paragraph as its own complete <speak> document, and put the marker line given before the paragraph (e.g., [[PARAGRAPH 1]]) right before its SSML.
+        Do not merge, split or skip paragraphs.
+
+        {paragraphs}
+        """
+        marked_paragraphs = "\n\n".join(f"[[PARAGRAPH {i}]]\n{paragraph}" for i, paragraph in enumerate(paragraphs, start=1))
+
+        prompt = PromptTemplate(input_variables=["paragraphs"], template=prompt_template)
+        chain = LLMChain(llm=self.llm, prompt=prompt)
+        answer = self.llm_cache.run(chain, {"paragraphs": marked_paragraphs})
+
+        ssml_texts = self.split_ssml_batch(answer, len(paragraphs))
+
+        failed = [i for i, ssml_text in enumerate(ssml_texts) if ssml_text is None]
+        if failed:
+            print(f"Warning: Batched SSML was invalid for {len(failed)} of {len(paragraphs)} paragraphs, requesting them again.")
+        for i in failed:
+            ssml_texts[i] = self.get_ssml_text(paragraphs[i])
+
+        return ssml_texts
+
+    @staticmethod
+    def split_ssml_batch(answer, count):
+        """
+        Split a batched answer on its paragraph markers.
+        :return: A list of count SSML documents, with None for each paragraph that is missing or not well-formed
+        """
+        ssml_texts = [None] * count
+        parts = re.split(r"\[\[PARAGRAPH (\d+)\]\]", answer)
+
+        # re.split alternates text and captured paragraph numbers: [before, number, text, number, text, ...]
+        for number, text in zip(parts[1::2], parts[2::2]):
+            index = int(number) - 1
+            start, end = text.find("<speak"), text.rfind("</speak>")
+            if not 0 <= index < count or start == -1 or end < start:
+                continue
+
+            ssml_text = text[start:end + len("</speak>")]
+            try:
+                ET.fromstring(ssml_text)
+            except ET.ParseError:
+                continue
+            ssml_texts[index] = ssml_text
+
+        return ssml_texts
+
+    def narrate_section(self, paragraphs, mp3_file_names, executor):
+        """
+        Generate the SSML of a whole section in one request, then narrate its paragraphs on executor.
+        :return: The futures of the paragraph durations, in paragraph order
+        """
+        futures = [None] * len(paragraphs)
+        pending = []
+        for i, (paragraph, mp3_file_name) in enumerate(zip(paragraphs, mp3_file_names)):
+            record = self.manifest.get(f"audio:{mp3_file_name}", self.paragraph_fingerprint(paragraph))
+            if record:
+                print(f"Audio already generated: {mp3_file_name}")
+                futures[i] = executor.submit(lambda duration: duration, record["result"])
+            else:
+                pending.append(i)
+
+        if pending:
+            ssml_texts = self.get_ssml_texts([paragraphs[i] for i in pending])
+            for i, ssml_text in zip(pending, ssml_texts):
+                futures[i] = executor.submit(self.narrate_paragraph, paragraphs[i], ssml_text, mp3_file_names[i])
+
+        return futures
+
+    def paragraph_fingerprint(self, paragraph):
+        return self.manifest.fingerprint(paragraph, self.voice_name, self.language_code, self.gender)
+
+    def narrate_paragraph(self, paragraph, ssml_text, mp3_file_name):
+        """
+        Narrate a paragraph's SSML and record the outcome in the run manifest.
+        """
+        unit = f"audio:{mp3_file_name}"
+        fingerprint = self.paragraph_fingerprint(paragraph)
+        try:
+            with tracer.span("narrate_paragraph", "unit", file=mp3_file_name):
+                duration = self.narrate_text_with_ssml(ssml_text, output_file=mp3_file_name)
+        except Exception as e:
+            self.manifest.mark_failed(unit, e, fingerprint=fingerprint)
+            raise
+
+        self.manifest.mark_done(unit, output=os.path.join(self.audio_dir, mp3_file_name), fingerprint=fingerprint, result=duration)
+        return duration
+
     def narrate_text_with_ssml(self, ssml_text, output_file="output.mp3"):
         """
         Generate audio from SSML text for each paragraph.
         """
+        output_path = os.path.join(self.audio_dir, output_file)
+
+        # Reuse the narration of a previous run when the SSML and voice settings are unchanged
+        cache_key = self.audio_cache.make_key(ssml_text, self.voice_name, self.language_code, self.gender, "MP3")
+        duration = self.audio_cache.fetch(cache_key, output_path)
+        if duration is not None:
+            metrics.cached("audio", "google_tts", characters=len(ssml_text))
+            print(f"Audio content reused from cache: {output_file}")
+            return duration
+
         synthesis_input = texttospeech.SynthesisInput(ssml=ssml_text)
 
         voice = texttospeech.VoiceSelectionParams(
@@ -56,29 +176,60 @@ class AudioGenerator:
 
         audio_config = texttospeech.AudioConfig(audio_encoding=texttospeech.AudioEncoding.MP3)
 
-        response = self.client.synthesize_speech(
-            input=synthesis_input, voice=voice, audio_config=audio_config
-        )
+        # Google bills every character of the SSML input, tags included
+        with metrics.measure("audio", "google_tts", characters=len(ssml_text)) as call:
+            response = get_rate_limiter("google_tts").call(
+                self.client.synthesize_speech, input=synthesis_input, voice=voice, audio_config=audio_config
+            )
+            call["bytes"] = len(response.audio_content)
+
+        # The previous file may be a hard link into the audio cache, so replace it instead of writing through it
+        if os.path.exists(output_path):
+            os.remove(output_path)
 
-        output_path = os.path.join(self.audio_dir, output_file)
         with open(output_path, "wb") as out:
             out.write(response.audio_content)
             print(f"Audio content written to file: {output_file}")
         
-        # Calculate the duration of the generated audio
-        audio = AudioSegment.from_mp3(output_path)
-        return len(audio) / 1000  # Duration in seconds
+        # Calculate the duration of the generated audio from the MP3 frame headers
+        duration = get_mp3_duration(output_path)  # Duration in seconds
+
+        self.audio_cache.store(cache_key, output_path, duration)
+        return duration
+
+    def generate_audio_for_paragraph(self, paragraph, mp3_file_name):
+        """
+        Generate SSML and narration for a single paragraph and return its duration.
+        """
+        record = self.manifest.get(f"audio:{mp3_file_name}", self.paragraph_fingerprint(paragraph))
+        if record:
+            print(f"Audio already generated: {mp3_file_name}")
+            return record["result"]
+
+        ssml_text = self.get_ssml_text(paragraph)
+        return self.narrate_paragraph(paragraph, ssml_text, mp3_file_name)
 
     def generate_audio_for_paragraphs(self, paragraph_files=["intro.txt", "call_to_adventure.txt", "refusal_of_call.txt", 
                                                            "mentor.txt", "crossing_the_threshold.txt", "trials_and_allies.txt", 
                                                            "climax_and_return.txt"]):
         """
         Generate audio for each paragraph, save them as individual MP3 files, and calculate the duration.
+        Paragraphs are independent, so up to max_workers of them are narrated at the same time.
         """
-        audio_durations = {}
+        audio_durations = self.narrate_sections(paragraph_files)
+        self.write_audio_durations(audio_durations)
+
+        return audio_durations
+
+    def narrate_sections(self, paragraph_files):
+        """
+        Narrate every paragraph of the given section files.
+        :return: The durations by MP3 file name, in section/paragraph order
+        """
+        sections = []
 
         for section in paragraph_files:
-            file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tmp', 'paragraphs', section)
+            file_path = os.path.join(self.paragraphs_dir, section)
 
             if not os.path.exists(file_path):
                 print(f"File {section} not found!")
@@ -87,23 +238,43 @@ class AudioGenerator:
             with open(file_path, "r") as file:
                 paragraphs = file.read().split("\n\n")  # Assuming paragraphs are separated by two newlines
 
-            for i, paragraph in enumerate(paragraphs, start=1):
-                print(f"Generating audio for Paragraph {i} in {section}")
-                ssml_text = self.get_ssml_text(paragraph)
-                mp3_file_name = f"{section.replace('.txt', '')}_paragraph_{i}.mp3"
+            mp3_file_names = [f"{section.replace('.txt', '')}_paragraph_{i}.mp3" for i in range(1, len(paragraphs) + 1)]
+            sections.append((section, paragraphs, mp3_file_names))
 
-                duration = self.narrate_text_with_ssml(ssml_text, output_file=mp3_file_name)
-                audio_durations[mp3_file_name] = duration
+        with ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as executor, \
+             ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as section_executor:
+            section_futures = []
+            for section, paragraphs, mp3_file_names in sections:
+                if self.batch_ssml:
+                    print(f"Generating audio for {len(paragraphs)} paragraphs in {section}")
+                    section_futures.append(section_executor.submit(self.narrate_section, paragraphs, mp3_file_names, executor))
+                else:
+                    futures = []
+                    for i, (paragraph, mp3_file_name) in enumerate(zip(paragraphs, mp3_file_names), start=1):
+                        print(f"Generating audio for Paragraph {i} in {section}")
+                        futures.append(executor.submit(self.generate_audio_for_paragraph, paragraph, mp3_file_name))
+                    section_futures.append(futures)
+
+            # Collect results in submission order so the durations keep the section/paragraph order
+            audio_durations = {}
+            for (_, _, mp3_file_names), futures in zip(sections, section_futures):
+                if not isinstance(futures, list):
+                    futures = futures.result()
+                for mp3_file_name, future in zip(mp3_file_names, futures):
+                    audio_durations[mp3_file_name] = future.result()
 
-        # Write the durations to a file
+        return audio_durations
+
+    def write_audio_durations(self, audio_durations):
+        """
+        Write the durations to audio_durations.txt, in the order they are given.
+        """
         audio_durations_file = os.path.join(self.audio_dir, 'audio_durations.txt')
         with open(audio_durations_file, "w") as out_file:
             for audio_file, duration in audio_durations.items():
                 out_file.write(f"{audio_file}: {duration:.2f} seconds\n")
             print(f"Audio durations written to file: {audio_durations_file}")
 
-        return audio_durations
-
 # Example usage
 if __name__ == "__main__":
     audio_generator = AudioGenerator()
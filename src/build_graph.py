@@ -0,0 +1,177 @@
+import os
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from tracing import tracer
+
+def hash_file(path):
+    """SHA-256 of a file's content, or None if the file doesn't exist."""
+    if not os.path.exists(path):
+        return None
+    sha = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+class BuildNode:
+    def __init__(self, name, action, deps=(), inputs=(), params=None, outputs=()):
+        """
+        One artifact of the build.
+        :param name: Unique node name (e.g., "audio:intro.txt:1")
+        :param action: Callable receiving a dictionary of dependency results and returning this node's result (JSON-serializable)
+        :param deps: Names of the nodes this one depends on
+        :param inputs: Files read by the action; their content is part of the input hash
+        :param params: JSON-serializable values the action depends on (e.g., paragraph text, voice settings)
+        :param outputs: Files written by the action; the node is rebuilt if any of them is missing
+        """
+        self.name = name
+        self.action = action
+        self.deps = list(deps)
+        self.inputs = list(inputs)
+        self.params = params
+        self.outputs = list(outputs)
+
+class BuildGraph:
+    def __init__(self, state_file, max_workers=4):
+        """
+        Make-like runner: a node is rebuilt only when its input hash changed or an output is missing,
+        and independent nodes run concurrently.
+        :param state_file: JSON file with the input/output hashes and results of the previous builds
+        :param max_workers: Maximum number of nodes running at once
+        """
+        self.state_file = state_file
+        self.max_workers = max_workers
+        self.nodes = {}
+        self.lock = threading.Lock()
+        self.state = self.load_state()
+
+    def add(self, node):
+        if node.name in self.nodes:
+            raise ValueError(f"Duplicate build node: {node.name}")
+        self.nodes[node.name] = node
+        return node
+
+    def load_state(self):
+        if os.path.exists(self.state_file):
+            with open(self.state_file, "r") as file:
+                return json.load(file)
+        return {}
+
+    def save_state(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.state_file)), exist_ok=True)
+        tmp_path = f"{self.state_file}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(self.state, file, indent=2)
+        os.replace(tmp_path, self.state_file)
+
+    def previous_result(self, name):
+        """Result of the node's last build, or None; lets an action reuse the parts of it whose inputs didn't change."""
+        with self.lock:
+            return self.state.get(name, {}).get("result")
+
+    def input_hash(self, node):
+        """
+        Hash the node's params, input files and the output hashes of its dependencies.
+        Depending on output hashes means a rebuilt dependency with identical output doesn't cascade.
+        """
+        payload = {
+            "params": node.params,
+            "inputs": {path: hash_file(path) for path in node.inputs},
+            "deps": {dep: self.state.get(dep, {}).get("output_hash") for dep in node.deps},
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def output_hash(self, node, result):
+        payload = {
+            "result": result,
+            "outputs": {path: hash_file(path) for path in node.outputs},
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def is_up_to_date(self, node, input_hash):
+        previous = self.state.get(node.name)
+        if not previous or previous.get("input_hash") != input_hash:
+            return False
+        return all(os.path.exists(path) for path in node.outputs)
+
+    def collect(self, targets):
+        """Return the names of the targets and everything they depend on."""
+        selected = set()
+        stack = list(targets)
+        while stack:
+            name = stack.pop()
+            if name in selected:
+                continue
+            if name not in self.nodes:
+                raise KeyError(f"Unknown build node: {name}")
+            selected.add(name)
+            stack.extend(self.nodes[name].deps)
+        return selected
+
+    def run(self, targets=None, force=()):
+        """
+        Build the targets (all nodes by default), skipping up-to-date nodes.
+        :param force: Node names to rebuild even if they are up to date
+        :return: The results of all selected nodes
+        """
+        selected = self.collect(targets or list(self.nodes))
+        done = set()
+        running = {}
+        rebuilt = []
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while len(done) < len(selected):
+                # Schedule every node whose dependencies are done, until no more nodes become ready
+                progress = True
+                while progress:
+                    progress = False
+                    for name in selected:
+                        node = self.nodes[name]
+                        if name in done or name in running or not all(dep in done for dep in node.deps):
+                            continue
+                        progress = True
+
+                        input_hash = self.input_hash(node)
+                        if name not in force and self.is_up_to_date(node, input_hash):
+                            # Outputs may have been edited by hand; refresh their hash so dependents notice
+                            previous = self.state[name]
+                            output_hash = self.output_hash(node, previous.get("result"))
+                            if output_hash != previous.get("output_hash"):
+                                with self.lock:
+                                    previous["output_hash"] = output_hash
+                                    self.save_state()
+                            done.add(name)
+                            continue
+
+                        dep_results = {dep: self.state.get(dep, {}).get("result") for dep in node.deps}
+                        print(f"Building {name}")
+                        running[name] = (executor.submit(tracer.traced(name, "build")(node.action), dep_results), input_hash)
+
+                if not running:
+                    if len(done) < len(selected):
+                        raise RuntimeError("Build graph has a dependency cycle.")
+                    break
+
+                finished, _ = wait([future for future, _ in running.values()], return_when=FIRST_COMPLETED)
+                for name, (future, input_hash) in list(running.items()):
+                    if future not in finished:
+                        continue
+                    del running[name]
+
+                    # A failed node stops the build; finished nodes stay recorded so the next run resumes
+                    result = future.result()
+                    node = self.nodes[name]
+                    with self.lock:
+                        self.state[name] = {
+                            "input_hash": input_hash,
+                            "output_hash": self.output_hash(node, result),
+                            "result": result,
+                        }
+                        self.save_state()
+                    done.add(name)
+                    rebuilt.append(name)
+
+        print(f"Build complete: {len(rebuilt)} of {len(selected)} node(s) rebuilt.")
+        return {name: self.state.get(name, {}).get("result") for name in selected}
@@ -0,0 +1,28 @@
+import os
+
+def evict_lru(directory, max_bytes, accept):
+    """
+    Remove the least recently used files of a cache directory until the accepted ones fit in max_bytes.
+    Caches touch their entries on every hit, so the modification time is the last use.
+    :param accept: Predicate on a file name selecting the cache entries (e.g., skipping partial writes)
+    """
+    entries = []
+    for name in os.listdir(directory):
+        if not accept(name):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
@@ -1,14 +1,21 @@
 import os
+import json
+import threading
 import warnings
+import requests
+from concurrent.futures import Future, wait
 from dotenv import load_dotenv
 from langchain.chains import LLMChain
 from langchain_community.chat_models import ChatOpenAI
 from langchain.prompts import PromptTemplate
 from leonardo_image_generator import LeonardoImageGenerator
 from better_profanity import profanity  
+from llm_cache import LLMCache
+from run_manifest import get_run_manifest
+from tracing import tracer
 
 class ImageGenerator:
-    def __init__(self):
+    def __init__(self, use_llm_cache=True, batch_prompts=None, manifest=None, workspace_dir=None):
         warnings.filterwarnings("ignore")
 
         # Load environment variables from the .env file
@@ -17,17 +24,30 @@ class ImageGenerator:
 
         # Set up the OpenAI GPT-4 model with LangChain (using ChatOpenAI)
         self.llm = ChatOpenAI(temperature=0.7, model="gpt-4", max_tokens=300)
+        self.llm_cache = LLMCache(stage="images", enabled=use_llm_cache)
+        self.session = requests.Session()  # Shared by every Leonardo request and download
+        self.leonardo = None  # One Leonardo client and poller for every image of the run, created on first use
+        self.leonardo_lock = threading.Lock()
+        self.root_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+        self.workspace_dir = workspace_dir or self.root_dir
+        self.paragraphs_dir = os.path.join(self.workspace_dir, 'tmp', 'paragraphs')
+        self.manifest = manifest or get_run_manifest(os.path.join(self.workspace_dir, 'tmp', 'manifest.json'))  # Images saved by an interrupted run are skipped
+
+        # None for one prompt request per paragraph, "section" or "script" to batch the requests
+        self.batch_prompts = batch_prompts
+        self.max_batch_paragraphs = 12  # Larger batches are split, so 300 tokens per prompt fit in the 4000-token answer cap
 
         # Ensure the tmp/images directory exists
-        self.images_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tmp', 'images')
+        self.images_dir = os.path.join(self.workspace_dir, 'tmp', 'images')
         os.makedirs(self.images_dir, exist_ok=True)
 
     def read_context_from_file(self, filename):
-        """Utility function to read content from a file if it exists."""
-        file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', filename)
-        if os.path.exists(file_path):
-            with open(file_path, "r") as file:
-                return file.read().strip()
+        """Utility function to read content from a file if it exists, preferring the workspace's own copy."""
+        for directory in (self.workspace_dir, self.root_dir):
+            file_path = os.path.join(directory, filename)
+            if os.path.exists(file_path):
+                with open(file_path, "r") as file:
+                    return file.read().strip()
         return ""        
 
     def get_image_prompt(self, paragraph_text):
@@ -50,14 +70,79 @@ class ImageGenerator:
         Paragraph: {paragraph_text}
         """
 
-        prompt = PromptTemplate(input_variables=["paragraph_text"], template=prompt_template)
+        prompt = PromptTemplate(input_variables=["image_context", "paragraph_text"], template=prompt_template)
         chain = LLMChain(llm=self.llm, prompt=prompt)
-        image_prompt = chain.run(paragraph_text)
+        image_prompt = self.llm_cache.run(chain, {"image_context": image_context, "paragraph_text": paragraph_text})
 
         # Apply profanity filter to the image prompt
         clean_prompt = profanity.censor(image_prompt)
         return clean_prompt[:1500]
 
+    def get_image_prompts(self, paragraphs):
+        """
+        Generate image prompts for several paragraphs in a single LLM request.
+        More than max_batch_paragraphs paragraphs are split into several requests, so no answer gets truncated.
+        Falls back to one request per paragraph when the answer doesn't hold one prompt per paragraph.
+        """
+        if len(paragraphs) > self.max_batch_paragraphs:
+            # Evenly sized chunks, e.g. 21 paragraphs become 11 + 10 rather than 12 + 9
+            chunks = -(-len(paragraphs) // self.max_batch_paragraphs)
+            size = -(-len(paragraphs) // chunks)
+            return [image_prompt for start in range(0, len(paragraphs), size) for image_prompt in self.get_image_prompts(paragraphs[start:start + size])]
+
+        image_context = self.read_context_from_file("image_context.txt")
+
+        prompt_template = """
+        For each of the numbered paragraphs below, create a prompt for a hyper-realistic, YouTube-style image. 
+        Each image should reflect the tone, environment, and subject matter of its paragraph.
+        Use vivid details and imagine the scene in high quality.
+
+        Please ensure that the prompts avoid any offensive, vulgar, or inappropriate language, 
+        including any form of the word "fuck" or similar words, and any other profanities or slurs. 
+        Ensure that only appropriate and respectful language is used throughout the prompts.
+
+        Context: {image_context}\n\n
+        Paragraphs:
+        {paragraphs}
+
+        Answer only with a JSON array of exactly {count} strings, where string N is the image prompt for paragraph N.
+        """
+
+        numbered_paragraphs = "\n\n".join(f"{i}. {paragraph}" for i, paragraph in enumerate(paragraphs, start=1))
+
+        # Each prompt gets the same token allowance as a single-paragraph request
+        llm = ChatOpenAI(temperature=0.7, model="gpt-4", max_tokens=300 * len(paragraphs))
+        prompt = PromptTemplate(input_variables=["image_context", "paragraphs", "count"], template=prompt_template)
+        chain = LLMChain(llm=llm, prompt=prompt)
+        answer = self.llm_cache.run(chain, {"image_context": image_context, "paragraphs": numbered_paragraphs, "count": len(paragraphs)})
+
+        image_prompts = self.parse_image_prompts(answer, len(paragraphs))
+        if image_prompts is None:
+            print(f"Warning: Batched image prompts didn't match the {len(paragraphs)} paragraphs, generating them one by one.")
+            return [self.get_image_prompt(paragraph) for paragraph in paragraphs]
+
+        # Apply profanity filter to the image prompts
+        return [profanity.censor(image_prompt)[:1500] for image_prompt in image_prompts]
+
+    @staticmethod
+    def parse_image_prompts(answer, count):
+        """
+        Extract the list of prompts from a batched answer.
+        :return: The prompts, or None if the answer isn't a JSON array of count non-empty strings
+        """
+        start, end = answer.find("["), answer.rfind("]")
+        if start == -1 or end < start:
+            return None
+
+        try:
+            image_prompts = json.loads(answer[start:end + 1])
+        except ValueError:
+            return None
+
+        if len(image_prompts) != count or not all(isinstance(item, str) and item.strip() for item in image_prompts):
+            return None
+        return image_prompts
+
     def get_thumbnail_prompt(self, title, video_topic):
         """
         Generate a highly engaging prompt for creating a YouTube thumbnail.
@@ -83,9 +168,9 @@ class ImageGenerator:
         Generate a detailed prompt for this thumbnail.
         """
         
-        prompt = PromptTemplate(input_variables=["title", "video_topic"], template=prompt_template)
+        prompt = PromptTemplate(input_variables=["thumbnail_context", "title", "video_topic"], template=prompt_template)
         chain = LLMChain(llm=self.llm, prompt=prompt)
-        thumbnail_prompt = chain.run(title=title, video_topic=video_topic)
+        thumbnail_prompt = self.llm_cache.run(chain, {"thumbnail_context": thumbnail_context, "title": title, "video_topic": video_topic})
 
         # Apply profanity filter to the generated prompt
         clean_prompt = profanity.censor(thumbnail_prompt)
@@ -97,10 +182,25 @@ class ImageGenerator:
         """
         Reads the paragraph files from tmp/paragraphs and generates and saves images for each paragraph.
         """
+        image_prompts, jobs = self.create_image_jobs(paragraph_files)
+        jobs.append(self.create_thumbnail_job())
+
+        self.save_prompts_to_file(image_prompts)
+
+        # Submit every image at once and poll them together
+        self.generate_images(jobs)
+
+    def create_image_jobs(self, paragraph_files):
+        """
+        Generate the image prompts for the paragraphs of the given files.
+        :return: The prompts by paragraph, and the (prompt, save_path) jobs for LeonardoImageGenerator
+        """
         image_prompts = {}  
+        jobs = []
+        sections = []
 
         for file_name in paragraph_files:
-            file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tmp', 'paragraphs', file_name)
+            file_path = os.path.join(self.paragraphs_dir, file_name)
 
             if not os.path.exists(file_path):
                 print(f"File {file_name} not found!")
@@ -109,19 +209,39 @@ class ImageGenerator:
             with open(file_path, "r") as file:
                 paragraphs = file.read().split("\n\n")  # Assuming paragraphs are separated by two newlines
 
-            for i, paragraph in enumerate(paragraphs, start=1):
+            sections.append((file_name, paragraphs))
+
+        # Group the paragraphs into one LLM request per section, per script, or per paragraph
+        if self.batch_prompts == "script":
+            batches = [[(file_name, i, paragraph) for file_name, paragraphs in sections for i, paragraph in enumerate(paragraphs, start=1)]]
+        elif self.batch_prompts == "section":
+            batches = [[(file_name, i, paragraph) for i, paragraph in enumerate(paragraphs, start=1)] for file_name, paragraphs in sections]
+        else:
+            batches = [[(file_name, i, paragraph)] for file_name, paragraphs in sections for i, paragraph in enumerate(paragraphs, start=1)]
+
+        for batch in batches:
+            if len(batch) == 1:
+                file_name, i, paragraph = batch[0]
                 print(f"Generating image prompt for Paragraph {i} in {file_name}")
-                image_prompt = self.get_image_prompt(paragraph)
+                prompts = [self.get_image_prompt(paragraph)]
+            else:
+                print(f"Generating image prompts for {len(batch)} paragraphs in {', '.join(dict.fromkeys(entry[0] for entry in batch))}")
+                prompts = self.get_image_prompts([paragraph for _, _, paragraph in batch])
+
+            for (file_name, i, _), image_prompt in zip(batch, prompts):
                 image_prompts[f"{file_name}_paragraph_{i}"] = image_prompt
 
-                # Initialize LeonardoImageGenerator
                 save_path = os.path.join(self.images_dir, f"{file_name.replace('.txt', '')}_paragraph_{i}.jpg")
-                image_generator = LeonardoImageGenerator(save_path)
-                image_generator.manage_request(image_prompt)  # Generate and save the image
-                print()
+                jobs.append((image_prompt, save_path))
 
-        # Generate thumbnail prompt and image
-        paragraphs_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tmp', 'paragraphs')
+        return image_prompts, jobs
+
+    def create_thumbnail_job(self):
+        """
+        Generate the thumbnail prompt from the video title and SEO description.
+        :return: The (prompt, save_path) job for LeonardoImageGenerator
+        """
+        paragraphs_dir = self.paragraphs_dir
 
         with open(os.path.join(paragraphs_dir, 'video_title.txt'), 'r') as file:
             title = file.read().strip()
@@ -129,19 +249,88 @@ class ImageGenerator:
         with open(os.path.join(paragraphs_dir, 'seo_description.txt'), 'r') as file:
             description = file.read().strip()
 
-        print("Generating thumbnail image...")
+        print("Generating thumbnail prompt...")
         thumbnail_prompt = self.get_thumbnail_prompt(title, description)
-        thumbnail_path = os.path.join(self.images_dir, "thumbnail.jpg")
-        thumbnail_generator = LeonardoImageGenerator(thumbnail_path)
-        thumbnail_generator.manage_request(thumbnail_prompt)
+        return thumbnail_prompt, os.path.join(self.images_dir, "thumbnail.jpg")
 
-        self.save_prompts_to_file(image_prompts)
+    def generate_image_for_paragraph(self, paragraph, save_path):
+        """
+        Generate the prompt and image for a single paragraph.
+        :return: The image prompt
+        """
+        with tracer.span("generate_image_for_paragraph", "unit", file=os.path.basename(save_path)):
+            image_prompt = self.get_image_prompt(paragraph)
+            self.generate_images([(image_prompt, save_path)])
+        return image_prompt
+
+    def get_leonardo(self):
+        with self.leonardo_lock:
+            if self.leonardo is None:
+                self.leonardo = LeonardoImageGenerator(session=self.session)
+            return self.leonardo
+
+    def generate_images(self, jobs):
+        """
+        Generate and save the images of the (prompt, save_path) jobs, skipping the ones the run manifest records as done,
+        and wait for them. Images submitted by other threads keep being polled alongside.
+        :raises RuntimeError: If any of the images failed
+        """
+        self.wait_for_images(self.submit_images(jobs))
+
+    @staticmethod
+    def wait_for_images(futures):
+        """
+        Wait for every future returned by submit_images, then raise if any image failed,
+        so nothing gets built or uploaded without it.
+        """
+        wait(futures)
+        errors = [str(future.exception()) for future in futures if future.exception() is not None]
+        if errors:
+            raise RuntimeError(f"{len(errors)} image(s) failed: " + "; ".join(errors))
+
+    def submit_images(self, jobs):
+        """
+        Start the images of the (prompt, save_path) jobs on the shared Leonardo poller without waiting for them,
+        skipping the ones the run manifest records as done.
+        :return: One future per started job, resolved when the job ends: with the save path, or an exception if it failed
+        """
+        fingerprints = {}
+        pending = []
+        for image_prompt, save_path in jobs:
+            unit = f"image:{os.path.basename(save_path)}"
+            fingerprints[save_path] = self.manifest.fingerprint(image_prompt)
+            if self.manifest.is_done(unit, fingerprints[save_path]):
+                print(f"Image already generated: {save_path}")
+            else:
+                pending.append((image_prompt, save_path))
+
+        if not pending:
+            return []
+
+        futures = {save_path: Future() for _, save_path in pending}
+
+        def on_complete(save_path, error):
+            unit = f"image:{os.path.basename(save_path)}"
+            try:
+                if error is None:
+                    self.manifest.mark_done(unit, output=save_path, fingerprint=fingerprints[save_path])
+                else:
+                    self.manifest.mark_failed(unit, error, fingerprint=fingerprints[save_path])
+            finally:
+                if error is None:
+                    futures[save_path].set_result(save_path)
+                else:
+                    futures[save_path].set_exception(RuntimeError(f"{save_path}: {error}"))
+
+        print()
+        self.get_leonardo().submit(pending, on_complete)
+        return list(futures.values())
 
     def save_prompts_to_file(self, image_prompts):
         """
         Save the generated image prompts to a text file.
         """
-        output_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tmp', 'images', 'image_prompts.txt')
+        output_file = os.path.join(self.images_dir, 'image_prompts.txt')
 
         with open(output_file, "w") as file:
             for file_name, prompt in image_prompts.items():
@@ -1,10 +1,15 @@
 import requests
 import time
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from rate_limiter import get_rate_limiter
+from metrics import metrics
+from tracing import tracer
 
 class LeonardoImageGenerator:
-    def __init__(self, save_path):
+    def __init__(self, save_path=None, session=None, max_downloads=4):
         env_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.env')
         load_dotenv(dotenv_path=env_path)
 
@@ -14,14 +19,27 @@ class LeonardoImageGenerator:
 
         self.url = "https://cloud.leonardo.ai/api/rest/v1/generations"
         self.save_path = save_path
-        self.delay = 15
+        self.session = session or requests.Session()  # Pooled connections shared by every request
+        self.max_downloads = max_downloads
+        self.limiter = get_rate_limiter("leonardo")
+
+        # Polling backoff: first poll after initial_delay, then grow by backoff up to max_delay
+        self.initial_delay = 3
+        self.max_delay = 15
+        self.backoff = 1.5
+
+        # Jobs being polled, shared by every submitter: generationId -> [save_path, next poll time, current delay, on_complete]
+        self.pending = {}
+        self.condition = threading.Condition()
+        self.poller = None  # Runs while jobs are pending, started again by the next submit
+        self.downloads = ThreadPoolExecutor(max_workers=max_downloads)
 
     def make_initial_request(self, prompt, num_images=1, width=1280, height=720, steps=15, seed=42):
         headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
-        
+
         data = {
             "prompt": prompt,
             "num_images": num_images,
@@ -36,8 +54,11 @@ class LeonardoImageGenerator:
             "seed": seed
         }
 
-        response = requests.post(self.url, headers=headers, json=data)
-        
+        with metrics.measure("images", "leonardo", images=num_images) as call:
+            response = self.limiter.call(self.session.post, self.url, headers=headers, json=data)
+            if response.status_code != 200:
+                call["error"] = response.status_code
+
         if response.status_code == 200:
             return response.json().get('sdGenerationJob', {}).get('generationId')
         else:
@@ -51,55 +72,134 @@ class LeonardoImageGenerator:
             "Content-Type": "application/json"
         }
 
-        response = requests.get(status_url, headers=headers)
+        with metrics.measure("images", "leonardo_status") as call:
+            response = self.limiter.call(self.session.get, status_url, headers=headers)
+            if response.status_code != 200:
+                call["error"] = response.status_code
 
         if response.status_code == 200:
             status_data = response.json()
 
             generations_by_pk = status_data.get("generations_by_pk", {})
             generated_images = generations_by_pk.get("generated_images", [])
-            
-            if generated_images:  
+
+            if generated_images:
                 return "completed", generated_images
+            elif generations_by_pk.get("status") == "FAILED":
+                return "failed", None
             else:
-                print("No images generated yet.")
                 return "in_progress", generated_images
         else:
             print(f"Error: {response.status_code} - {response.text}")
             return "failed", None
 
-    def download_image(self, image_url):
-        response = requests.get(image_url)
+    def download_image(self, image_url, save_path=None):
+        save_path = save_path or self.save_path
+        with metrics.measure("images", "leonardo_download") as call:
+            response = self.session.get(image_url)
+            call["bytes"] = len(response.content)
+            if response.status_code != 200:
+                call["error"] = response.status_code
 
         if response.status_code == 200:
             # Save the image directly to the path provided
-            with open(self.save_path, 'wb') as f:
+            with open(save_path, 'wb') as f:
                 f.write(response.content)
-            print(f"Image successfully downloaded and saved to {self.save_path}")
+            print(f"Image successfully downloaded and saved to {save_path}")
+            return True
         else:
             print(f"Error downloading the image: {response.status_code} - {response.text}")
+            return False
 
     def manage_request(self, prompt):
-        generation_id = self.make_initial_request(prompt)
-        if not generation_id:
-            return
+        self.manage_requests([(prompt, self.save_path)])
+
+    def manage_requests(self, jobs, on_complete=None):
+        """
+        Submit every generation job up front, then wait until all of them are downloaded or failed.
+        :param jobs: A list of (prompt, save_path) tuples
+        :param on_complete: Optional callback called as on_complete(save_path, error) when a job ends; error is None on success
+        """
+        on_complete = on_complete or (lambda save_path, error: None)
+        remaining = threading.Semaphore(0)
+
+        def on_job_complete(save_path, error):
+            on_complete(save_path, error)
+            remaining.release()
 
-        print("Waiting for image generation...")
-        time.sleep(self.delay)
+        self.submit(jobs, on_job_complete)
+        print(f"Waiting for {len(jobs)} image generation(s)...")
+        for _ in jobs:
+            remaining.acquire()
 
+    def submit(self, jobs, on_complete):
+        """
+        Start generation jobs and hand them to the shared poller, without waiting for them.
+        Jobs can be submitted from several threads and at any time, so every job in flight is polled from a single loop,
+        each with its own exponential backoff, and downloaded as soon as it completes.
+        :param jobs: A list of (prompt, save_path) tuples
+        :param on_complete: Called as on_complete(save_path, error) when a job ends; error is None on success
+        """
+        for prompt, save_path in jobs:
+            generation_id = self.make_initial_request(prompt)
+            if not generation_id:
+                print(f"Image generation could not be started for {save_path}")
+                on_complete(save_path, "generation could not be started")
+                continue
+
+            with self.condition:
+                self.pending[generation_id] = [save_path, time.monotonic() + self.initial_delay, self.initial_delay, on_complete]
+                if self.poller is None:
+                    self.poller = threading.Thread(target=self.poll, name="leonardo-poller", daemon=True)
+                    self.poller.start()
+                self.condition.notify()
+
+    def download(self, image_url, save_path, on_complete):
+        try:
+            downloaded = self.download_image(image_url, save_path)
+        except Exception as e:
+            on_complete(save_path, f"download failed: {e}")
+            return
+        on_complete(save_path, None if downloaded else "download failed")
+
+    def poll(self):
+        """Poll the pending jobs, earliest due first, until none is left."""
         while True:
-            status, generated_images = self.check_request_status(generation_id)
-            
+            with self.condition:
+                if not self.pending:
+                    self.poller = None
+                    return
+
+                generation_id = min(self.pending, key=lambda job_id: self.pending[job_id][1])
+                save_path, next_poll, delay, on_complete = self.pending[generation_id]
+                if next_poll > time.monotonic():
+                    # Woken early when a new job is submitted, since it may be due first
+                    with tracer.span("leonardo_poll_wait", "wait"):
+                        self.condition.wait(next_poll - time.monotonic())
+                    continue
+
+            try:
+                status, generated_images = self.check_request_status(generation_id)
+            except Exception as e:
+                print(f"Image generation status could not be checked for {save_path}: {e}")
+                status, generated_images = "failed", None
+
+            with self.condition:
+                if status == "in_progress":
+                    delay = min(delay * self.backoff, self.max_delay)
+                    self.pending[generation_id] = [save_path, time.monotonic() + delay, delay, on_complete]
+                    continue
+                del self.pending[generation_id]
+                remaining = len(self.pending)
+
             if status == "completed":
                 image_url = generated_images[0]["url"]
                 if image_url:
-                    print("Image generated successfully!")
+                    print(f"Image generated successfully! ({remaining} remaining)")
                     print("Image URL:", image_url)
-                    self.download_image(image_url)  
-                    break
-            elif status == "failed":
-                print("Image generation failed.")
-                break
+                    self.downloads.submit(self.download, image_url, save_path, on_complete)
+                else:
+                    on_complete(save_path, "no image URL")
             else:
-                print(f"Waiting... (status: {status})")
-                time.sleep(self.delay)
+                print(f"Image generation failed for {save_path}.")
+                on_complete(save_path, "generation failed")
@@ -0,0 +1,109 @@
+import os
+import json
+import hashlib
+import threading
+from langchain_community.callbacks import get_openai_callback
+from rate_limiter import get_rate_limiter
+from metrics import metrics
+from cache_eviction import evict_lru
+
+class LLMCache:
+    def __init__(self, stage, enabled=True, cache_dir=None, max_bytes=50 * 1024 * 1024):
+        """
+        On-disk, content-addressed cache for LLMChain calls.
+        :param stage: Pipeline stage using the cache (e.g., "script", "audio", "images")
+        :param enabled: Set to False to bypass the cache for this stage
+        :param cache_dir: Directory holding the cached responses
+        :param max_bytes: Size bound of the cache; least recently used entries are evicted beyond it
+        """
+        self.stage = stage
+        self.enabled = enabled
+        self.cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tmp', 'cache', 'llm')
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def make_key(self, llm, prompt_text):
+        """
+        Hash the model, temperature, answer token cap and rendered prompt into a cache key.
+        """
+        model = getattr(llm, "model_name", None) or getattr(llm, "model", "")
+        temperature = getattr(llm, "temperature", None)
+        max_tokens = getattr(llm, "max_tokens", None)  # A capped answer may be truncated, so it isn't valid under another cap
+        payload = json.dumps([model, temperature, max_tokens, prompt_text])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def run(self, chain, inputs):
+        """
+        Run an LLMChain through the cache.
+        :param chain: The LLMChain to run
+        :param inputs: A dictionary with the prompt input variables
+        :return: The chain output, from the cache when the same prompt was already answered
+        """
+        with metrics.measure(self.stage, "openai") as call:
+            self.local.usage = call
+
+            key = None
+            if self.enabled:
+                prompt_inputs = {name: inputs[name] for name in chain.prompt.input_variables}
+                key = self.make_key(chain.llm, chain.prompt.format(**prompt_inputs))
+
+                output = self.get(key)
+                if output is not None:
+                    call["cached"] = True
+                    # Keep the conversation memory consistent with an uncached run
+                    if chain.memory is not None:
+                        chain.memory.save_context(inputs, {chain.output_key: output})
+                    return output
+
+            with get_openai_callback() as callback:
+                output = get_rate_limiter("openai").call(chain.run, inputs)
+            call["tokens_in"] = callback.prompt_tokens
+            call["tokens_out"] = callback.completion_tokens
+            call["cost_usd"] = callback.total_cost
+
+            if key:
+                self.put(key, output)
+            return output
+
+    def last_usage(self):
+        """Usage of the last run() call of this thread: tokens_in, tokens_out, cost_usd, latency..."""
+        return getattr(self.local, "usage", None)
+
+    def get(self, key):
+        path = os.path.join(self.cache_dir, f"{key}.json")
+        try:
+            with open(path, "r") as file:
+                output = json.load(file)["output"]
+        except (OSError, ValueError, KeyError):
+            with self.lock:
+                self.misses += 1
+            return None
+
+        # Touch the entry so eviction treats it as recently used
+        os.utime(path, None)
+        with self.lock:
+            self.hits += 1
+        return output
+
+    def put(self, key, output):
+        path = os.path.join(self.cache_dir, f"{key}.json")
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump({"stage": self.stage, "output": output}, file)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in max_bytes.
+        """
+        with self.lock:
+            evict_lru(self.cache_dir, self.max_bytes, lambda name: name.endswith(".json"))
+
+    def stats(self):
+        return {"stage": self.stage, "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,103 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+# Seconds each kind of YouTube metadata stays fresh; None never expires
+DEFAULT_TTLS = {
+    "channel_id": None,        # A handle keeps pointing to the same channel
+    "playlist_page": 60 * 60,  # New uploads show up within the hour
+    "video": 15 * 60,          # View counts move quickly
+}
+
+# Seconds a response without items stays fresh, whatever its kind (e.g., a mistyped handle or one not created yet)
+EMPTY_TTL = 10 * 60
+
+class MetadataCache:
+    def __init__(self, enabled=True, db_file=None, ttls=None):
+        """
+        SQLite store of YouTube Data API responses, with a TTL per kind of data and the ETag of each response.
+        Expired responses stored with an ETag are revalidated with If-None-Match, so unchanged resources come back
+        as 304 Not Modified. Responses without items expire after EMPTY_TTL, so a missing resource is looked up again.
+        :param enabled: Set to False to always call the API
+        :param db_file: SQLite database file (shared by every workspace and process)
+        :param ttls: Overrides of DEFAULT_TTLS
+        """
+        self.enabled = enabled
+        self.db_file = db_file or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tmp', 'cache', 'youtube.sqlite')
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.quota_saved = 0
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_file)), exist_ok=True)
+        self.connection = sqlite3.connect(self.db_file, timeout=30, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "kind TEXT NOT NULL, key TEXT NOT NULL, etag TEXT, data TEXT NOT NULL, fetched REAL NOT NULL, "
+                "PRIMARY KEY (kind, key))"
+            )
+
+    def lookup(self, kind, key):
+        """
+        :return: (data, etag, fresh) of the cached response, or (None, None, False) when nothing is cached
+        """
+        if not self.enabled:
+            return None, None, False
+
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT data, etag, fetched FROM responses WHERE kind = ? AND key = ?", (kind, key)
+            ).fetchone()
+        if row is None:
+            return None, None, False
+
+        data, etag, fetched = row
+        data = json.loads(data)
+        ttl = self.ttls.get(kind)
+        if data.get("kind", "").endswith("ListResponse") and not data.get("items"):  # The API omits empty items
+            ttl = EMPTY_TTL if ttl is None else min(ttl, EMPTY_TTL)
+        fresh = ttl is None or time.time() - fetched < ttl
+        return data, etag, fresh
+
+    def store(self, kind, key, data, etag=None):
+        if not self.enabled:
+            return
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (kind, key, etag, data, fetched) VALUES (?, ?, ?, ?, ?)",
+                (kind, key, etag, json.dumps(data), time.time()),
+            )
+
+    def touch(self, kind, key):
+        """Restart the TTL of an entry that the API confirmed unchanged."""
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE responses SET fetched = ? WHERE kind = ? AND key = ?", (time.time(), kind, key)
+            )
+
+    def record(self, outcome, quota_cost=0):
+        """
+        Count a lookup outcome: "hit" (served from the cache), "revalidated" (304) or "miss".
+        """
+        with self.lock:
+            if outcome == "hit":
+                self.hits += 1
+                self.quota_saved += quota_cost
+            elif outcome == "revalidated":
+                self.revalidated += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "misses": self.misses,
+            "quota_saved": self.quota_saved,
+        }
@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from tracing import tracer
+
+# Upper bounds (seconds) of the latency histogram buckets; the last bucket is unbounded
+LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]
+
+# Usage counters of a provider call
+USAGE_FIELDS = ("tokens_in", "tokens_out", "characters", "units", "images", "bytes", "cost_usd", "retries", "queue_wait")
+
+class Metrics:
+    def __init__(self):
+        """
+        Process-wide record of every external call: tokens, characters, quota units, latency and retries,
+        grouped by pipeline stage and provider.
+        """
+        self.records = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.started = time.time()
+
+    def reset(self):
+        """Start a new run."""
+        with self.lock:
+            self.records = []
+            self.started = time.time()
+
+    @contextmanager
+    def measure(self, stage, provider, **usage):
+        """
+        Time one provider call and record it when the block exits.
+        The yielded dictionary takes the usage known after the call (e.g., call["tokens_out"] = 42),
+        and call["cached"] = True marks a call served from a local cache.
+        :param stage: Pipeline stage making the call (e.g., "script", "audio", "images", "upload")
+        :param provider: Provider called (e.g., "openai", "google_tts", "leonardo", "youtube")
+        """
+        call = {"stage": stage, "provider": provider, "cached": False, "error": None}
+        call.update({field: 0 for field in USAGE_FIELDS})
+        call.update(usage)
+
+        stack = self.local.__dict__.setdefault("stack", [])
+        stack.append(call)
+        start = time.monotonic()
+        try:
+            with tracer.span(provider, "provider", stage=stage):
+                yield call
+        except Exception as e:
+            call["error"] = type(e).__name__
+            raise
+        finally:
+            call["latency"] = time.monotonic() - start
+            stack.pop()
+            with self.lock:
+                self.records.append(call)
+
+    def cached(self, stage, provider, **usage):
+        """Record a call served from a local cache instead of the provider."""
+        with self.measure(stage, provider, cached=True, **usage):
+            pass
+
+    def add(self, **usage):
+        """Add usage to the innermost call being measured in this thread (e.g., retries from the rate limiter)."""
+        stack = getattr(self.local, "stack", None)
+        if stack:
+            for field, value in usage.items():
+                stack[-1][field] = stack[-1].get(field, 0) + value
+
+    @staticmethod
+    def percentile(values, fraction):
+        if not values:
+            return 0.0
+        return values[min(len(values) - 1, int(fraction * len(values)))]
+
+    def summary(self):
+        """
+        Totals and latency distribution per "stage/provider".
+        Cached calls are counted separately and left out of the usage and latency figures, since they cost nothing.
+        """
+        with self.lock:
+            records = list(self.records)
+
+        groups = {}
+        for call in records:
+            groups.setdefault(f"{call['stage']}/{call['provider']}", []).append(call)
+
+        summary = {}
+        for name, calls in sorted(groups.items()):
+            live = [call for call in calls if not call["cached"]]
+            latencies = sorted(call["latency"] for call in live)
+
+            histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+            for latency in latencies:
+                histogram[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+
+            summary[name] = {
+                "calls": len(live),
+                "cached": len(calls) - len(live),
+                "errors": sum(1 for call in calls if call["error"]),
+                **{field: round(sum(call[field] for call in live), 4) for field in USAGE_FIELDS},
+                "latency_total": round(sum(latencies), 3),
+                "latency_p50": round(self.percentile(latencies, 0.5), 3),
+                "latency_p95": round(self.percentile(latencies, 0.95), 3),
+                "latency_max": round(latencies[-1], 3) if latencies else 0.0,
+                "latency_histogram": {
+                    f"<={bound}s" if index < len(LATENCY_BUCKETS) else f">{LATENCY_BUCKETS[-1]}s": count
+                    for index, (bound, count) in enumerate(zip(LATENCY_BUCKETS + [None], histogram))
+                },
+            }
+        return summary
+
+    def write_summary(self, summary_file):
+        """
+        Write the run summary (per stage/provider and overall totals) as JSON.
+        :return: The summary
+        """
+        per_group = self.summary()
+        report = {
+            "started": self.started,
+            "wall_time": round(time.time() - self.started, 3),
+            "totals": {
+                field: round(sum(group[field] for group in per_group.values()), 4)
+                for field in ("calls", "cached", "errors") + USAGE_FIELDS
+            },
+            "by_stage_provider": per_group,
+        }
+
+        os.makedirs(os.path.dirname(os.path.abspath(summary_file)), exist_ok=True)
+        tmp_path = f"{summary_file}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(report, file, indent=2)
+        os.replace(tmp_path, summary_file)
+        return report
+
+metrics = Metrics()
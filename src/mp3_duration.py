@@ -0,0 +1,190 @@
+import os
+import glob
+import time
+import struct
+from tracing import tracer
+
+# Bitrates in kbps, indexed by [MPEG-1 or not][layer][bitrate index]
+BITRATES = {
+    True: {
+        1: [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+        2: [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+        3: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    },
+    False: {
+        1: [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+        2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+        3: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    },
+}
+
+# Sample rates in Hz, indexed by the two version bits of the frame header
+SAMPLE_RATES = {
+    3: [44100, 48000, 32000],  # MPEG-1
+    2: [22050, 24000, 16000],  # MPEG-2
+    0: [11025, 12000, 8000],   # MPEG-2.5
+}
+
+def parse_frame_header(data, offset):
+    """
+    Parse the 4-byte MPEG audio frame header at offset.
+    :return: A dictionary with the frame properties, or None if there is no valid header there
+    """
+    if offset + 4 > len(data):
+        return None
+
+    header = struct.unpack(">I", data[offset:offset + 4])[0]
+    if header & 0xFFE00000 != 0xFFE00000:
+        return None
+
+    version_bits = (header >> 19) & 0x3
+    layer = 4 - ((header >> 17) & 0x3)
+    bitrate_index = (header >> 12) & 0xF
+    sample_rate_index = (header >> 10) & 0x3
+    padding = (header >> 9) & 0x1
+    channel_mode = (header >> 6) & 0x3
+
+    if version_bits == 1 or layer == 4 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    mpeg1 = version_bits == 3
+    bitrate = BITRATES[mpeg1][layer][bitrate_index] * 1000
+    sample_rate = SAMPLE_RATES[version_bits][sample_rate_index]
+
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate // sample_rate + padding) * 4
+    elif layer == 2 or mpeg1:
+        samples = 1152
+        length = 144 * bitrate // sample_rate + padding
+    else:
+        samples = 576
+        length = 72 * bitrate // sample_rate + padding
+
+    return {
+        "mpeg1": mpeg1,
+        "layer": layer,
+        "sample_rate": sample_rate,
+        "samples": samples,
+        "length": length,
+        "mono": channel_mode == 3,
+    }
+
+def skip_id3v2(data):
+    """Return the offset of the first byte after an ID3v2 tag, if the file starts with one."""
+    if len(data) < 10 or data[:3] != b"ID3":
+        return 0
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+def trailing_tags_length(data):
+    """Length of the ID3v1 and APE tags at the end of the file, where the frame walk must stop."""
+    end = len(data)
+    if end >= 128 and data[end - 128:end - 125] == b"TAG":
+        end -= 128
+    if end >= 32 and data[end - 32:end - 24] == b"APETAGEX":
+        # APE footer: preamble, version, tag size (items and footer), item count, flags (bit 31: tag has a header)
+        size, _, flags = struct.unpack("<III", data[end - 20:end - 8])
+        end -= size + (32 if flags & 0x80000000 else 0)
+    return len(data) - end
+
+def read_vbr_sample_count(data, offset, frame):
+    """
+    Read the total sample count from a Xing/Info or VBRI header stored in the first frame.
+    The encoder delay and padding recorded in a LAME tag are not part of the audio and are left out.
+    """
+    if frame["mpeg1"]:
+        side_info = 17 if frame["mono"] else 32
+    else:
+        side_info = 9 if frame["mono"] else 17
+
+    xing = offset + 4 + side_info
+    if data[xing:xing + 4] in (b"Xing", b"Info") and len(data) >= xing + 12:
+        flags = struct.unpack(">I", data[xing + 4:xing + 8])[0]
+        if flags & 0x1:
+            samples = struct.unpack(">I", data[xing + 8:xing + 12])[0] * frame["samples"]
+
+            # The LAME tag follows the optional frame count, byte count, TOC and quality fields
+            lame = xing + 8 + sum(size for flag, size in ((0x1, 4), (0x2, 4), (0x4, 100), (0x8, 4)) if flags & flag)
+            if data[lame:lame + 4] in (b"LAME", b"L3.9", b"Lavc", b"Lavf") and len(data) >= lame + 24:
+                delay_padding = int.from_bytes(data[lame + 21:lame + 24], "big")  # 12 bits each
+                samples -= (delay_padding >> 12) + (delay_padding & 0xFFF)
+            return samples
+
+    vbri = offset + 4 + 32
+    if data[vbri:vbri + 4] == b"VBRI" and len(data) >= vbri + 18:
+        return struct.unpack(">I", data[vbri + 14:vbri + 18])[0] * frame["samples"]
+
+    return None
+
+def read_mp3_duration(path):
+    """
+    Compute the duration of an MP3 file from its frame headers, without decoding any audio.
+    Uses the Xing/Info or VBRI frame count when present and otherwise walks the frame headers.
+    :return: Duration in seconds
+    :raises ValueError: If there are no frames, or the walk hits an invalid frame before the end of the audio
+    """
+    with open(path, "rb") as file:
+        data = file.read()
+
+    # Find the first frame, allowing for an ID3v2 tag and some leading junk
+    offset = skip_id3v2(data)
+    frame = None
+    while offset < len(data) - 4:
+        frame = parse_frame_header(data, offset)
+        if frame and parse_frame_header(data, offset + frame["length"]) is not None:
+            break
+        frame = None
+        offset += 1
+
+    if frame is None:
+        raise ValueError(f"No MPEG audio frames found in {path}")
+
+    sample_rate = frame["sample_rate"]
+    sample_count = read_vbr_sample_count(data, offset, frame)
+    if sample_count:
+        return sample_count / sample_rate
+
+    # Walk every frame up to the trailing tags; a partial sum would silently shorten the narration
+    audio_end = len(data) - trailing_tags_length(data)
+    total_samples = 0
+    while offset < audio_end:
+        frame = parse_frame_header(data, offset)
+        if frame is None or frame["length"] <= 0:
+            raise ValueError(f"Invalid MPEG audio frame at byte {offset} of {path}")
+        total_samples += frame["samples"]
+        offset += frame["length"]
+
+    return total_samples / sample_rate
+
+def decode_mp3_duration(path):
+    """Compute the duration by fully decoding the file with pydub (ffmpeg)."""
+    from pydub import AudioSegment
+    with tracer.span("pydub_decode", "decode", file=os.path.basename(path)):
+        return len(AudioSegment.from_mp3(path)) / 1000
+
+def get_mp3_duration(path):
+    """
+    Duration of an MP3 file in seconds, read from the frame headers.
+    Falls back to a full decode only when the headers are unusable.
+    """
+    try:
+        return read_mp3_duration(path)
+    except (OSError, ValueError, KeyError, ZeroDivisionError) as e:
+        print(f"Warning: Could not read MP3 headers of {path} ({e}), decoding instead.")
+        return decode_mp3_duration(path)
+
+# Micro-benchmark of the header and decode paths on the generated narration
+if __name__ == "__main__":
+    audio_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tmp', 'audios')
+    mp3_files = sorted(glob.glob(os.path.join(audio_dir, "*.mp3")))
+
+    if not mp3_files:
+        print(f"No MP3 files found in {audio_dir}")
+    else:
+        for name, function in [("headers", read_mp3_duration), ("decode", decode_mp3_duration)]:
+            start = time.perf_counter()
+            durations = [function(path) for path in mp3_files]
+            elapsed = time.perf_counter() - start
+            print(f"{name:>8}: {elapsed * 1000:8.1f} ms for {len(mp3_files)} files, total {sum(durations):.2f} s of audio")
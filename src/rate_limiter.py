@@ -0,0 +1,161 @@
+import time
+import threading
+from email.utils import parsedate_to_datetime
+from metrics import metrics
+
+# Requests per second, burst size and concurrent in-flight calls allowed for each provider
+PROVIDER_LIMITS = {
+    "openai": {"rate": 3, "burst": 5, "max_concurrent": 4},
+    "google_tts": {"rate": 10, "burst": 10, "max_concurrent": 8},
+    "leonardo": {"rate": 2, "burst": 5, "max_concurrent": 5},
+    "youtube": {"rate": 10, "burst": 20, "max_concurrent": 8},
+}
+
+class RateLimiter:
+    def __init__(self, provider, rate, burst, max_concurrent, max_retries=5):
+        """
+        Token bucket plus concurrency limit for one provider.
+        Calls beyond the limits wait in line instead of failing; rate-limited calls are retried.
+        :param provider: Provider name used in logs and stats
+        :param rate: Tokens added to the bucket per second
+        :param burst: Bucket capacity
+        :param max_concurrent: Maximum number of calls in flight at once
+        :param max_retries: Retries of a call that keeps being rate limited
+        """
+        self.provider = provider
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+
+        self.calls = 0
+        self.retries = 0
+        self.wait_time = 0.0
+        self.service_time = 0.0
+
+    def acquire(self):
+        """
+        Wait for a token and a free slot.
+        :return: Seconds spent waiting in the queue
+        """
+        start = time.monotonic()
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    break
+
+                delay = max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(delay)
+
+        self.slots.acquire()
+        return time.monotonic() - start
+
+    def pause(self, delay):
+        """Hold back every queued call of this provider for delay seconds."""
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+
+    def call(self, function, *args, **kwargs):
+        """
+        Run function(*args, **kwargs) within the provider limits.
+        A 429 response or exception is retried after its Retry-After delay.
+        """
+        for attempt in range(self.max_retries + 1):
+            wait = self.acquire()
+            metrics.add(queue_wait=wait)
+            start = time.monotonic()
+            try:
+                result = function(*args, **kwargs)
+            except Exception as e:
+                delay = self.retry_after(e, attempt)
+                if delay is None or attempt == self.max_retries:
+                    raise
+            else:
+                delay = self.retry_after(result, attempt)
+                if delay is None or attempt == self.max_retries:
+                    return result
+            finally:
+                self.slots.release()
+                self.record(wait, time.monotonic() - start)
+
+            with self.lock:
+                self.retries += 1
+            metrics.add(retries=1)
+            print(f"{self.provider}: rate limited, retrying in {delay:.1f}s")
+            self.pause(delay)
+
+    def record(self, wait, service):
+        with self.lock:
+            self.calls += 1
+            self.wait_time += wait
+            self.service_time += service
+
+    @staticmethod
+    def retry_after(result, attempt):
+        """
+        Return the delay before retrying if result is a rate-limit response or error, otherwise None.
+        Understands requests responses, Google API errors and OpenAI errors.
+        """
+        status = getattr(result, "status_code", None) or getattr(result, "http_status", None) or getattr(result, "code", None)
+        if status is None and getattr(result, "resp", None) is not None:
+            status = getattr(result.resp, "status", None)
+        if callable(status):
+            status = status()
+
+        try:
+            status = int(status)
+        except (TypeError, ValueError):
+            return None
+        if status != 429:
+            return None
+
+        headers = getattr(result, "headers", None) or getattr(result, "resp", None) or {}
+        value = headers.get("Retry-After") or headers.get("retry-after")
+        if value:
+            try:
+                return max(0.0, float(value))
+            except ValueError:
+                try:
+                    return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+                except (TypeError, ValueError):
+                    pass
+        return float(2 ** attempt)
+
+    def stats(self):
+        return {
+            "provider": self.provider,
+            "calls": self.calls,
+            "retries": self.retries,
+            "queue_wait_s": round(self.wait_time, 3),
+            "service_time_s": round(self.service_time, 3),
+        }
+
+def share_provider_limits(processes):
+    """
+    Split every provider limit evenly between processes, so a process pool stays within the overall limits.
+    Must be called in each process before its first rate-limited call.
+    """
+    for limits in PROVIDER_LIMITS.values():
+        limits["rate"] = limits["rate"] / processes
+        limits["burst"] = max(1, limits["burst"] // processes)
+        limits["max_concurrent"] = max(1, limits["max_concurrent"] // processes)
+
+rate_limiters = {}
+rate_limiters_lock = threading.Lock()
+
+def get_rate_limiter(provider):
+    """Return the process-wide RateLimiter shared by every caller of provider."""
+    with rate_limiters_lock:
+        if provider not in rate_limiters:
+            rate_limiters[provider] = RateLimiter(provider, **PROVIDER_LIMITS[provider])
+        return rate_limiters[provider]
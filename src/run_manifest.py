@@ -0,0 +1,97 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from build_graph import hash_file
+
+class RunManifest:
+    def __init__(self, manifest_file):
+        """
+        Crash-safe record of the units of work of a run (one narration, one image, the video, the upload).
+        Every change is written atomically, so an interrupted run can skip what already succeeded.
+        :param manifest_file: JSON file holding the manifest
+        """
+        self.manifest_file = manifest_file
+        self.lock = threading.Lock()
+        self.units = {}
+
+        if os.path.exists(manifest_file):
+            try:
+                with open(manifest_file, "r") as file:
+                    self.units = json.load(file)
+            except ValueError:
+                print(f"Warning: Ignoring unreadable manifest {manifest_file}")
+
+    @staticmethod
+    def fingerprint(*values):
+        """Hash the inputs of a unit of work, so a unit recorded for other inputs isn't reused."""
+        return hashlib.sha256(json.dumps(values, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.manifest_file)), exist_ok=True)
+        tmp_path = f"{self.manifest_file}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(self.units, file, indent=2)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.manifest_file)
+
+    def get(self, unit, fingerprint=None):
+        """
+        Return the record of a unit that completed for the same inputs and whose output is intact, otherwise None.
+        """
+        with self.lock:
+            record = self.units.get(unit)
+
+        if not record or record.get("status") != "done" or record.get("fingerprint") != fingerprint:
+            return None
+
+        output = record.get("output")
+        if output and hash_file(output) != record.get("checksum"):
+            return None
+        return record
+
+    def is_done(self, unit, fingerprint=None):
+        return self.get(unit, fingerprint) is not None
+
+    def mark_done(self, unit, output=None, fingerprint=None, result=None):
+        record = {
+            "status": "done",
+            "output": output,
+            "checksum": hash_file(output) if output else None,
+            "fingerprint": fingerprint,
+            "result": result,
+            "updated": time.time(),
+        }
+        with self.lock:
+            self.units[unit] = record
+            self.save()
+
+    def mark_failed(self, unit, error, fingerprint=None):
+        record = {
+            "status": "failed",
+            "error": str(error),
+            "fingerprint": fingerprint,
+            "updated": time.time(),
+        }
+        with self.lock:
+            self.units[unit] = record
+            self.save()
+
+    def reset(self):
+        """Forget every unit, e.g., when a new script starts a new run."""
+        with self.lock:
+            self.units = {}
+            self.save()
+
+manifests = {}
+manifests_lock = threading.Lock()
+
+def get_run_manifest(manifest_file=None):
+    """Return the process-wide RunManifest for manifest_file (tmp/manifest.json by default)."""
+    manifest_file = os.path.abspath(manifest_file or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tmp', 'manifest.json'))
+    with manifests_lock:
+        if manifest_file not in manifests:
+            manifests[manifest_file] = RunManifest(manifest_file)
+        return manifests[manifest_file]
@@ -3,12 +3,15 @@ import warnings
 from dotenv import load_dotenv
 from youtube_retriever import YoutubeRetriever
 from langchain.chains import LLMChain
-from langchain.memory import ConversationBufferMemory
+from langchain.memory import ConversationBufferMemory, ConversationTokenBufferMemory
 from langchain_community.chat_models import ChatOpenAI
 from langchain.prompts import PromptTemplate
+from llm_cache import LLMCache
+from file_lock import file_lock
+from tracing import tracer
 
 class ScriptGenerator:
-    def __init__(self):
+    def __init__(self, use_llm_cache=True, memory_token_limit=None, workspace_dir=None):
         # Suppress warnings
         warnings.filterwarnings("ignore")
 
@@ -16,6 +19,12 @@ class ScriptGenerator:
         env_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.env')
         load_dotenv(dotenv_path=env_path)
 
+        # Every file of this pipeline lives under the workspace, so several pipelines can run side by side
+        self.root_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+        self.workspace_dir = workspace_dir or self.root_dir
+        self.paragraphs_dir = os.path.join(self.workspace_dir, 'tmp', 'paragraphs')
+        os.makedirs(self.paragraphs_dir, exist_ok=True)
+
         # Retrieve API keys from environment variables
         self.OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
         self.YOUTUBE_API_KEY = os.getenv("YOUTUBE_API_KEY")
@@ -28,14 +37,37 @@ class ScriptGenerator:
         
         # Initialize LangChain model
         self.llm = ChatOpenAI(model="gpt-4", temperature=0.1, openai_api_key=self.OPENAI_API_KEY)
+        self.llm_cache = LLMCache(stage="script", enabled=use_llm_cache)
         
         # Define memory to keep track of previous interactions
-        self.memory = ConversationBufferMemory(return_messages=True, input_key="combined_input")
+        if memory_token_limit:
+            # Keep the most recent sections verbatim within the budget and drop older ones. Tokens are counted locally,
+            # so the memory never calls the model itself and stays the same for the same sections (cached runs included)
+            self.memory = ConversationTokenBufferMemory(llm=self.llm, max_token_limit=memory_token_limit,
+                                                        return_messages=True, input_key="combined_input")
+        else:
+            self.memory = ConversationBufferMemory(return_messages=True, input_key="combined_input")
+
+        # Prompt and completion tokens of every LLM call, as (label, prompt_tokens, completion_tokens)
+        self.token_usage = []
+
+    def run_chain(self, label, chain, inputs):
+        """
+        Run a chain through the LLM cache and record its token usage.
+        """
+        with tracer.span(label, "unit"):
+            output = self.llm_cache.run(chain, inputs)
+        usage = self.llm_cache.last_usage()
 
-    def retrieve_video_details(self, handles_file="handles.txt"):
+        self.token_usage.append((label, usage["tokens_in"], usage["tokens_out"]))
+        print(f"[{label}] prompt tokens: {usage['tokens_in']}, completion tokens: {usage['tokens_out']}")
+        return output
+
+    def retrieve_video_details(self, handles_file=None):
         """
         Retrieve channel IDs and video details from YouTube based on the handles file.
         """
+        handles_file = handles_file or os.path.join(self.workspace_dir, "handles.txt")
         if not os.path.exists(handles_file):
             raise FileNotFoundError(f"Handles file not found: {handles_file}")
 
@@ -52,13 +84,21 @@ class ScriptGenerator:
         # Retrieve video details
         video_details_list = self.retriever.get_video_details(list(channel_ids.values()))
 
+        video_details_list = self.retriever.add_trends(video_details_list)
+
+        def format_rate(value, sign=""):
+            return "n/a" if value is None else f"{value:{sign},.1f}/h"
+
+        # Most accelerating videos first, so the LLM sees what is taking off right now rather than raw totals
         video_details = "\n".join(
-            f"Title: {video['title']}, Views: {video['views']}, Channel ID: {video['channel_id']}"
+            f"Title: {video['title']}, Views: {video['views']}, Views per hour: {format_rate(video['velocity'])}, "
+            f"Acceleration: {format_rate(video['delta'], '+')}, Channel ID: {video['channel_id']}"
             for video in video_details_list
         )
 
         print("\nVideo Details:")
         print(video_details)
+        print(f"YouTube quota used: {self.retriever.quota_stats()}")
 
         return video_details
 
@@ -69,7 +109,8 @@ class ScriptGenerator:
         context_prompt = PromptTemplate(
             input_variables=["video_details"],
             template=(
-                "Analyze the following list of video titles and their respective view counts:\n"
+                "Analyze the following list of video titles with their view counts, views per hour and acceleration "
+                "(change in views per hour since the last check), most accelerating first:\n"
                 "{video_details}\n\n"
                 "Based on this information, explain what this YouTube channel is about. "
                 "Describe the themes, the type of audience it targets, and the writing style used in the titles. "
@@ -81,71 +122,77 @@ class ScriptGenerator:
         channel_context_chain = LLMChain(llm=self.llm, prompt=context_prompt)
 
         # Generate channel context using LangChain
-        channel_context = channel_context_chain.run({"video_details": video_details})
+        channel_context = self.run_chain("channel_context", channel_context_chain, {"video_details": video_details})
         print("\nChannel Context:")
         print(channel_context)
 
         return channel_context
     
     def read_context_from_file(self, filename):
-        """Utility function to read content from a file if it exists."""
-        file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', filename)
-        if os.path.exists(file_path):
-            with open(file_path, "r") as file:
-                return file.read().strip()
+        """Utility function to read content from a file if it exists, preferring the workspace's own copy."""
+        for directory in (self.workspace_dir, self.root_dir):
+            file_path = os.path.join(directory, filename)
+            if os.path.exists(file_path):
+                with open(file_path, "r") as file:
+                    return file.read().strip()
         return ""    
 
-    def generate_unique_video_title(self, video_details, recent_titles_file="data/recent_titles.txt"):
+    def generate_unique_video_title(self, video_details, recent_titles_file=None):
         """
         Generate a unique video title, ensuring it doesn't repeat recent titles.
+        The recent titles history is shared by every workspace.
         """
+        recent_titles_file = recent_titles_file or os.path.join(self.root_dir, "data", "recent_titles.txt")
+
         # Ensure the directory exists for storing recent titles
         os.makedirs(os.path.dirname(recent_titles_file), exist_ok=True)
 
          # Read title context from title_context.txt if exists
         title_context = self.read_context_from_file("title_context.txt")
 
-        # Load recent titles
-        if os.path.exists(recent_titles_file):
-            with open(recent_titles_file, "r") as file:
-                recent_titles = [line.strip() for line in file if line.strip()]
-        else:
-            recent_titles = []
-
-        # Define prompt to generate a unique video title
-        unique_title_prompt = PromptTemplate(
-            input_variables=["recent_titles", "title_context", "video_details"],
-            template=(
-                "Context: {title_context}\n\n"
-                "Video Details (Top Viewed Videos):\n"
-                "{video_details}\n\n"
-                "Instructions:\n"
-                "1. Based on the Top Viewed Videos, generate a unique and engaging YouTube video title between 60-70 characters long.\n"
-                "2. Slightly modify the original concept, incorporating elements from the top viewed videos.\n"
-                "3. Ensure the title is clear, concise, and relevant to the content.\n"
-                "4. Avoid excessive punctuation or symbols.\n"
-                "5. The title must be distinct from the following recent titles:\n"
-                "{recent_titles}\n\n"
-                "Consider what would capture the audience's attention while staying true to the content."
+        # Hold the lock from reading to saving the history, so concurrent pipelines never pick the same title
+        with file_lock(recent_titles_file):
+            # Load recent titles
+            if os.path.exists(recent_titles_file):
+                with open(recent_titles_file, "r") as file:
+                    recent_titles = [line.strip() for line in file if line.strip()]
+            else:
+                recent_titles = []
+
+            # Define prompt to generate a unique video title
+            unique_title_prompt = PromptTemplate(
+                input_variables=["recent_titles", "title_context", "video_details"],
+                template=(
+                    "Context: {title_context}\n\n"
+                    "Video Details (Top Viewed Videos, most accelerating first):\n"
+                    "{video_details}\n\n"
+                    "Instructions:\n"
+                    "1. Based on the Top Viewed Videos, favoring the ones accelerating right now, generate a unique and engaging YouTube video title between 60-70 characters long.\n"
+                    "2. Slightly modify the original concept, incorporating elements from the top viewed videos.\n"
+                    "3. Ensure the title is clear, concise, and relevant to the content.\n"
+                    "4. Avoid excessive punctuation or symbols.\n"
+                    "5. The title must be distinct from the following recent titles:\n"
+                    "{recent_titles}\n\n"
+                    "Consider what would capture the audience's attention while staying true to the content."
+                )
             )
-        )
 
-        # Create chain for generating a unique video title
-        title_chain = LLMChain(llm=self.llm, prompt=unique_title_prompt)
+            # Create chain for generating a unique video title
+            title_chain = LLMChain(llm=self.llm, prompt=unique_title_prompt)
 
-        # Generate a new video title
-        recent_titles_str = "\n".join(recent_titles) if recent_titles else "None"
-        video_title = title_chain.run({"recent_titles": recent_titles_str, "title_context": title_context, "video_details": video_details}).strip()
+            # Generate a new video title
+            recent_titles_str = "\n".join(recent_titles) if recent_titles else "None"
+            video_title = self.run_chain("video_title", title_chain, {"recent_titles": recent_titles_str, "title_context": title_context, "video_details": video_details}).strip()
 
-        # Ensure the new title is added to the recent titles list and keep only the last 10
-        recent_titles.append(video_title)
-        recent_titles = recent_titles[-10:]
+            # Ensure the new title is added to the recent titles list and keep only the last 10
+            recent_titles.append(video_title)
+            recent_titles = recent_titles[-10:]
 
-        # Save updated recent titles back to the file
-        with open(recent_titles_file, "w") as file:
-            file.write("\n".join(recent_titles))
+            # Save updated recent titles back to the file
+            with open(recent_titles_file, "w") as file:
+                file.write("\n".join(recent_titles))
 
-        with open("tmp/paragraphs/video_title.txt", "w") as file:
+        with open(os.path.join(self.paragraphs_dir, "video_title.txt"), "w") as file:
             file.write(video_title.strip('\"'))            
 
         print("\nGenerated Video Title:", video_title)
@@ -170,13 +217,13 @@ class ScriptGenerator:
 
         # Create chain for generating SEO description
         seo_description_chain = LLMChain(llm=self.llm, prompt=seo_prompt)
-        seo_description = seo_description_chain.run({"seo_input": seo_input})
+        seo_description = self.run_chain("seo_description", seo_description_chain, {"seo_input": seo_input})
 
         print("\nSEO Description:")
         print(seo_description)
 
         # Save SEO description to file
-        seo_description_path = "tmp/paragraphs/seo_description.txt"
+        seo_description_path = os.path.join(self.paragraphs_dir, "seo_description.txt")
         os.makedirs(os.path.dirname(seo_description_path), exist_ok=True)
         
         with open(seo_description_path, "w") as file:
@@ -184,9 +231,10 @@ class ScriptGenerator:
 
         return seo_description    
 
-    def generate_video_script(self, combined_input):
+    def generate_video_script(self, combined_input, on_section=None):
         """
         Generate the video script (Hero's Journey) using LangChain.
+        :param on_section: Optional callback called with the file name of each section once it is saved
         """
         # Read script context from script_context.txt if exists
         script_context = self.read_context_from_file("script_context.txt")
@@ -272,47 +320,39 @@ class ScriptGenerator:
         trials_and_allies_chain = LLMChain(llm=self.llm, prompt=trials_and_allies_prompt, memory=self.memory)
         climax_and_return_chain = LLMChain(llm=self.llm, prompt=climax_and_return_prompt, memory=self.memory)
 
-        # Generate video script parts
-        intro = intro_chain.run({"combined_input": combined_input, "script_context": script_context})
+        # Ensure the directory exists for paragraphs
+        paragraphs_dir = self.paragraphs_dir
+        os.makedirs(paragraphs_dir, exist_ok=True)
+
+        def save_section(file_name, text):
+            # Save each section as soon as it is written, so later stages can start on it right away
+            with open(os.path.join(paragraphs_dir, file_name), "w") as file:
+                file.write(text)
+            if on_section:
+                on_section(file_name)
+
+        # Generate video script parts and save each section to a separate file
+        intro = self.run_chain("intro", intro_chain, {"combined_input": combined_input, "script_context": script_context})
+        save_section("intro.txt", intro)
         print("\nIntro section generated.")
-        call_to_adventure = call_to_adventure_chain.run({"combined_input": combined_input, "script_context": script_context})
+        call_to_adventure = self.run_chain("call_to_adventure", call_to_adventure_chain, {"combined_input": combined_input, "script_context": script_context})
+        save_section("call_to_adventure.txt", call_to_adventure)
         print("Call to Adventure section generated.")
-        refusal_of_call = refusal_of_call_chain.run({"combined_input": combined_input, "script_context": script_context})
+        refusal_of_call = self.run_chain("refusal_of_call", refusal_of_call_chain, {"combined_input": combined_input, "script_context": script_context})
+        save_section("refusal_of_call.txt", refusal_of_call)
         print("Refusal of Call section generated.")
-        mentor = mentor_chain.run({"combined_input": combined_input, "script_context": script_context})
+        mentor = self.run_chain("mentor", mentor_chain, {"combined_input": combined_input, "script_context": script_context})
+        save_section("mentor.txt", mentor)
         print("Mentor section generated.")
-        crossing_the_threshold = crossing_the_threshold_chain.run({"combined_input": combined_input, "script_context": script_context})
+        crossing_the_threshold = self.run_chain("crossing_the_threshold", crossing_the_threshold_chain, {"combined_input": combined_input, "script_context": script_context})
+        save_section("crossing_the_threshold.txt", crossing_the_threshold)
         print("Crossing the Threshold section generated.")
-        trials_and_allies = trials_and_allies_chain.run({"combined_input": combined_input, "script_context": script_context})
+        trials_and_allies = self.run_chain("trials_and_allies", trials_and_allies_chain, {"combined_input": combined_input, "script_context": script_context})
+        save_section("trials_and_allies.txt", trials_and_allies)
         print("Trials and Allies section generated.")
-        climax_and_return = climax_and_return_chain.run({"combined_input": combined_input, "script_context": script_context})
-        print("Climax and Return section generated.")        
-
-        # Ensure the directory exists for paragraphs
-        paragraphs_dir = "tmp/paragraphs"
-        os.makedirs(paragraphs_dir, exist_ok=True)
-
-        # Save each section to separate files
-        with open(os.path.join(paragraphs_dir, "intro.txt"), "w") as file:
-            file.write(intro)
-
-        with open(os.path.join(paragraphs_dir, "call_to_adventure.txt"), "w") as file:
-            file.write(call_to_adventure)
-
-        with open(os.path.join(paragraphs_dir, "refusal_of_call.txt"), "w") as file:
-            file.write(refusal_of_call)
-
-        with open(os.path.join(paragraphs_dir, "mentor.txt"), "w") as file:
-            file.write(mentor)
-
-        with open(os.path.join(paragraphs_dir, "crossing_the_threshold.txt"), "w") as file:
-            file.write(crossing_the_threshold)
-
-        with open(os.path.join(paragraphs_dir, "trials_and_allies.txt"), "w") as file:
-            file.write(trials_and_allies)
-
-        with open(os.path.join(paragraphs_dir, "climax_and_return.txt"), "w") as file:
-            file.write(climax_and_return)
+        climax_and_return = self.run_chain("climax_and_return", climax_and_return_chain, {"combined_input": combined_input, "script_context": script_context})
+        save_section("climax_and_return.txt", climax_and_return)
+        print("Climax and Return section generated.")
 
         # Combine all parts of the script
         full_script = f"{intro}\n\n{call_to_adventure}\n\n{refusal_of_call}\n\n{mentor}\n\n{crossing_the_threshold}\n\n{trials_and_allies}\n\n{climax_and_return}"
@@ -321,5 +361,6 @@ class ScriptGenerator:
 
         # Generate SEO description based on the memory content
         self.generate_seo_description()        
+        print(f"Total prompt tokens: {sum(prompt_tokens for _, prompt_tokens, _ in self.token_usage)}")
 
         return intro, call_to_adventure, refusal_of_call, mentor, crossing_the_threshold, trials_and_allies, climax_and_return, full_script
@@ -0,0 +1,63 @@
+import os
+import json
+import hashlib
+import threading
+from cache_eviction import evict_lru
+
+# Everything a rendered segment depends on: its inputs, its place in the timeline and the render settings
+KEY_FIELDS = (
+    "image_hash", "audio_hash", "duration", "length", "frames", "style", "seed", "fade_out",
+    "width", "height", "canvas_scale", "fade_duration", "fps", "codec", "bitrate", "preset",
+)
+
+class SegmentCache:
+    def __init__(self, enabled=True, cache_dir=None, max_bytes=2 * 1024 * 1024 * 1024):
+        """
+        Content-addressed store of rendered video segments, so a render only encodes the segments whose inputs changed
+        and stitches them with the cached ones.
+        :param enabled: Set to False to always render every segment
+        :param cache_dir: Directory holding the segment files (shared by every workspace)
+        :param max_bytes: Size bound of the cache; least recently used segments are evicted beyond it
+        """
+        self.enabled = enabled
+        self.cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tmp', 'cache', 'segments')
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def make_key(self, task):
+        payload = {field: task[field] for field in KEY_FIELDS}
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def lookup(self, task):
+        """
+        Find the cached file of a segment task.
+        :return: (path, cached): where the segment is or must be rendered to, and whether it already exists there.
+                 The path is None when the cache is disabled.
+        """
+        if not self.enabled:
+            return None, False
+
+        segment_path = os.path.join(self.cache_dir, f"{self.make_key(task)}.mp4")
+        cached = os.path.exists(segment_path)
+        if cached:
+            os.utime(segment_path, None)  # Touch the segment so eviction treats it as recently used
+        with self.lock:
+            if cached:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return segment_path, cached
+
+    def evict(self):
+        """
+        Remove the least recently used segments until the cache fits in max_bytes.
+        """
+        with self.lock:
+            evict_lru(self.cache_dir, self.max_bytes, lambda name: name.endswith(".mp4") and not name.endswith(".tmp.mp4"))
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
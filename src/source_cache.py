@@ -0,0 +1,68 @@
+import os
+import threading
+import numpy as np
+from build_graph import hash_file
+from cache_eviction import evict_lru
+
+class SourceCache:
+    def __init__(self, enabled=True, cache_dir=None, max_bytes=1024 * 1024 * 1024):
+        """
+        Content-addressed store of decoded, canvas-fitted source images as raw uint8 .npy arrays.
+        Renders and segment workers memory-map them instead of decoding and resampling the JPEGs again.
+        :param enabled: Set to False to always decode the images
+        :param cache_dir: Directory holding the arrays (shared by every workspace)
+        :param max_bytes: Size bound of the cache; least recently used arrays are evicted beyond it
+        """
+        self.enabled = enabled
+        self.cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tmp', 'cache', 'frames')
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def make_path(self, image_path, size):
+        """Array file of an image fitted to size (width, height): keyed by the image content and the size."""
+        return os.path.join(self.cache_dir, f"{hash_file(image_path)}_{size[0]}x{size[1]}.npy")
+
+    def prepare(self, image_path, size, decode):
+        """
+        Make sure the decoded image is cached.
+        :param decode: Function decoding image_path into a (height, width, 3) uint8 array of the given size
+        :return: The array file, or None when the cache is disabled
+        """
+        if not self.enabled:
+            return None
+
+        array_path = self.make_path(image_path, size)
+        if os.path.exists(array_path):
+            os.utime(array_path, None)  # Touch the array so eviction treats it as recently used
+            with self.lock:
+                self.hits += 1
+            return array_path
+
+        array = decode(image_path)
+        tmp_path = f"{array_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as file:
+            np.save(file, np.ascontiguousarray(array, dtype=np.uint8))
+        os.replace(tmp_path, array_path)
+
+        with self.lock:
+            self.misses += 1
+        return array_path
+
+    @staticmethod
+    def load(array_path):
+        """Map a cached array read-only, without copying it into memory."""
+        return np.load(array_path, mmap_mode="r")
+
+    def evict(self):
+        """
+        Remove the least recently used arrays until the cache fits in max_bytes.
+        """
+        with self.lock:
+            evict_lru(self.cache_dir, self.max_bytes, lambda name: name.endswith(".npy"))
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
@@ -0,0 +1,184 @@
+import os
+import sys
+import json
+import time
+import threading
+from functools import wraps
+from contextlib import contextmanager
+
+class Tracer:
+    def __init__(self, enabled=True):
+        """
+        Process-wide collector of timed spans, exported in the Chrome trace-event format
+        (open the file in https://ui.perfetto.dev or chrome://tracing).
+        Spans nest per thread, so a step shows its units of work and their provider calls below it.
+        :param enabled: Set to False to make spans free
+        """
+        self.enabled = enabled
+        self.events = []
+        self.thread_names = {}   # (pid, tid) -> thread name
+        self.process_names = {}  # pid -> process name, for the spans merged from other processes
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+
+    def reset(self, origin=None):
+        """
+        Start a new trace.
+        :param origin: perf_counter() value the timestamps count from. Worker processes pass their parent's,
+                       so their spans line up with the parent's (perf_counter is a system-wide monotonic clock)
+        """
+        with self.lock:
+            self.events = []
+            self.thread_names = {}
+            self.process_names = {}
+            self.origin = time.perf_counter() if origin is None else origin
+
+    def now(self):
+        """Microseconds since the start of the trace."""
+        return (time.perf_counter() - self.origin) * 1e6
+
+    @contextmanager
+    def span(self, name, category="pipeline", **args):
+        """
+        Time the block as one complete ("X") event of the current thread.
+        :param category: Event category, used for filtering in the viewer (e.g., "step", "unit", "provider")
+        :param args: Values shown with the event (e.g., file names)
+        """
+        if not self.enabled:
+            yield
+            return
+
+        thread = threading.current_thread()
+        start = self.now()
+        try:
+            yield
+        finally:
+            event = {
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": round(start, 1),
+                "dur": round(self.now() - start, 1),
+                "pid": os.getpid(),
+                "tid": thread.ident,
+            }
+            if args:
+                event["args"] = {key: str(value) for key, value in args.items()}
+            with self.lock:
+                self.events.append(event)
+                self.thread_names[(os.getpid(), thread.ident)] = thread.name
+
+    def traced(self, name=None, category="unit"):
+        """Decorator wrapping every call of a function in a span."""
+        def decorator(function):
+            span_name = name or function.__qualname__
+
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(span_name, category):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def export(self):
+        """The spans collected in this process, as plain values a worker process can return to its parent."""
+        with self.lock:
+            return {"events": list(self.events), "threads": [[pid, tid, name] for (pid, tid), name in self.thread_names.items()]}
+
+    def merge(self, exported, process_name):
+        """Add the spans exported by another process (e.g., a render worker) to this trace."""
+        with self.lock:
+            self.events.extend(exported["events"])
+            for pid, tid, name in exported["threads"]:
+                self.thread_names[(pid, tid)] = name
+                self.process_names[pid] = process_name
+
+    def write(self, trace_file):
+        """Write the collected spans as a Chrome trace-event JSON file."""
+        with self.lock:
+            events = list(self.events)
+            thread_names = dict(self.thread_names)
+            process_names = {**self.process_names, os.getpid(): "video_generator"}
+
+        metadata = [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": thread_name}}
+            for (pid, tid), thread_name in thread_names.items()
+        ]
+        metadata += [
+            {"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": process_name}}
+            for pid, process_name in process_names.items()
+        ]
+
+        os.makedirs(os.path.dirname(os.path.abspath(trace_file)), exist_ok=True)
+        tmp_path = f"{trace_file}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump({"traceEvents": metadata + sorted(events, key=lambda event: event["ts"]), "displayTimeUnit": "ms"}, file)
+        os.replace(tmp_path, trace_file)
+
+tracer = Tracer()
+
+@contextmanager
+def sample_stacks(profile_file, interval=0.005):
+    """
+    Sampling profiler for a block: a background thread snapshots the Python stack of every other thread
+    each interval seconds. The samples are written in the collapsed-stack format ("frame;frame;frame count"),
+    which flamegraph.pl and https://www.speedscope.app render as a flame graph.
+    :param profile_file: Output file (e.g., tmp/render_profile.folded)
+    :param interval: Seconds between samples
+    """
+    counts = {}
+    stop = threading.Event()
+
+    def sample():
+        sampler_id = threading.get_ident()
+        while not stop.wait(interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == sampler_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                key = ";".join(reversed(stack))
+                counts[key] = counts.get(key, 0) + 1
+
+    sampler = threading.Thread(target=sample, name="stack-sampler", daemon=True)
+    sampler.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        sampler.join()
+        write_stacks(profile_file, counts)
+        print(f"Stack samples written to {profile_file} ({sum(counts.values())} samples)")
+
+def read_stacks(profile_file):
+    """Read a collapsed-stack file into a dictionary of stack -> sample count."""
+    counts = {}
+    with open(profile_file, "r") as file:
+        for line in file:
+            stack, _, count = line.rstrip("\n").rpartition(" ")
+            if stack:
+                counts[stack] = counts.get(stack, 0) + int(count)
+    return counts
+
+def write_stacks(profile_file, counts):
+    os.makedirs(os.path.dirname(os.path.abspath(profile_file)), exist_ok=True)
+    with open(profile_file, "w") as file:
+        for stack, count in sorted(counts.items()):
+            file.write(f"{stack} {count}\n")
+
+def merge_stacks(profile_file, part_files):
+    """
+    Add the samples of other processes (e.g., one file per render worker) to a collapsed-stack file,
+    then remove the part files.
+    """
+    counts = read_stacks(profile_file) if os.path.exists(profile_file) else {}
+    for part_file in part_files:
+        if not os.path.exists(part_file):
+            continue
+        for stack, count in read_stacks(part_file).items():
+            counts[stack] = counts.get(stack, 0) + count
+        os.remove(part_file)
+    write_stacks(profile_file, counts)
@@ -1,25 +1,112 @@
 import os
+import sys
+import time
+import glob
+import contextlib
+import wave
+import subprocess
 import warnings
 import random
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from moviepy.editor import *
-from moviepy.video.fx.all import crop, fadein, fadeout
-from PIL import Image
+from moviepy.config import FFMPEG_BINARY
+from moviepy.video.io.ffmpeg_writer import FFMPEG_VideoWriter
+from run_manifest import get_run_manifest
+from build_graph import hash_file
+from tracing import tracer, sample_stacks, merge_stacks
+from motion_renderer import MotionRenderer, MOTION_STYLES
+from source_cache import SourceCache
+from segment_cache import SegmentCache
+
+# Encoding settings of each render: "final" is the uploaded video, "draft" a quick preview to review the pacing.
+# Both share the same motion, fades and narration timeline, only the output size, frame rate and encoder differ.
+# "threads" is the encoder's thread count in the single-pass render; segment workers encode with one thread each,
+# since render_workers processes already share the cores.
+RENDER_PROFILES = {
+    "final": {"width": 1280, "height": 720, "fps": 30, "codec": "libx264", "bitrate": "5000k", "preset": "medium", "threads": None},
+    "draft": {"width": 640, "height": 360, "fps": 15, "codec": "libx264", "bitrate": "1000k", "preset": "ultrafast", "threads": os.cpu_count()},
+}
+
+def render_segment(task):
+    """
+    Render one segment to its own video-only file. Runs in a worker process, so it only takes plain values.
+    The file is written under a temporary name and moved in place once complete, so a cached segment is never partial.
+    The worker traces the segment on the parent's clock and, when task["profile_file"] is set, samples its own stacks there.
+    :param task: Dictionary with the renderer settings, the segment and the output path
+    :return: The spans recorded in the worker, for the parent's tracer
+    """
+    tracer.reset(origin=task["trace_origin"])
+    profile = sample_stacks(task["profile_file"]) if task["profile_file"] else contextlib.nullcontext()
+    with profile, tracer.span("render_segment", "render", segment=task["name"], frames=task["frames"]):
+        write_segment(task)
+    return tracer.export()
+
+def write_segment(task):
+    renderer = MotionRenderer(task["width"], task["height"], canvas_scale=task["canvas_scale"], fade_duration=task["fade_duration"])
+    if task["source_path"]:
+        source = renderer.load_source(array=SourceCache.load(task["source_path"]))
+    else:
+        source = renderer.load_source(task["image_path"])
+
+    root, extension = os.path.splitext(task["output_path"])
+    tmp_path = f"{root}.{os.getpid()}.tmp{extension}"  # ffmpeg picks the container from the extension
+    writer = FFMPEG_VideoWriter(tmp_path, (task["width"], task["height"]), task["fps"], codec=task["codec"],
+                                bitrate=task["bitrate"], preset=task["preset"], threads=1)
+    try:
+        for index in range(task["frames"]):
+            writer.write_frame(renderer.render_frame(
+                source, task["style"], task["duration"], index / task["fps"], task["frames"] / task["fps"],
+                fade_out=task["fade_out"],
+            ))
+    finally:
+        writer.close()
+    os.replace(tmp_path, task["output_path"])
 
 class VideoEditor:
-    def __init__(self, images_dir=None):
+    def __init__(self, images_dir=None, manifest=None, workspace_dir=None, profile_file=None, parallel_render=True, render_workers=None, use_source_cache=True, render_profile="final",
+                 use_segment_cache=True, seed=None):
         warnings.filterwarnings("ignore")
         
-        self.images_dir = images_dir or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tmp', 'images')
-        self.videos_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tmp', 'videos')
-        self.audios_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tmp', 'audios')
+        self.workspace_dir = workspace_dir or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+        self.images_dir = images_dir or os.path.join(self.workspace_dir, 'tmp', 'images')
+        self.videos_dir = os.path.join(self.workspace_dir, 'tmp', 'videos')
+        self.audios_dir = os.path.join(self.workspace_dir, 'tmp', 'audios')
         
         os.makedirs(self.images_dir, exist_ok=True)
         os.makedirs(self.videos_dir, exist_ok=True)
         
-        self.video_width = 1280
-        self.video_height = 720
+        if render_profile not in RENDER_PROFILES:
+            raise ValueError(f"Unknown render profile: {render_profile}. Choose one of {', '.join(RENDER_PROFILES)}.")
+        settings = RENDER_PROFILES[render_profile]
+        self.render_profile = render_profile
+        self.video_width = settings["width"]
+        self.video_height = settings["height"]
         self.fade_duration = 2
+        self.fps = settings["fps"]
+        self.codec = settings["codec"]
+        self.bitrate = settings["bitrate"]
+        self.preset = settings["preset"]
+        self.threads = settings["threads"]
+        self.audio_rate = 44100
+        self.renderer = MotionRenderer(self.video_width, self.video_height, canvas_scale=1.2, fade_duration=self.fade_duration)
         self.image_audio_map = self.load_audio_durations()
+        self.manifest = manifest or get_run_manifest(os.path.join(self.workspace_dir, 'tmp', 'manifest.json'))  # The video isn't rendered again if its sources didn't change
+        self.profile_file = profile_file  # When set, the render's stacks are sampled into this file (collapsed-stack format)
+
+        # Render every segment in its own process and stitch them without re-encoding, instead of one moviepy pass
+        self.parallel_render = parallel_render
+        self.render_workers = render_workers or os.cpu_count()
+        self.segments_dir = os.path.join(self.videos_dir, 'segments', render_profile)
+
+        # Decoded images fitted to the canvas, prepared once and memory-mapped by every render
+        self.source_cache = SourceCache(enabled=use_source_cache)
+
+        # Rendered segments, reused by later renders as long as their inputs didn't change
+        self.segment_cache = SegmentCache(enabled=use_segment_cache)
+
+        # Motion styles are drawn from this seed and the image name, so re-rendering a video keeps its styles
+        self.seed = seed if seed is not None else self.load_video_title()
 
     def load_audio_durations(self):
         durations_file = os.path.join(self.audios_dir, "audio_durations.txt")
@@ -40,67 +127,261 @@ class VideoEditor:
         
         return image_audio_map
 
-    def create_video(self):
-        clips = []
-        audio_clips = []
-        total_duration = 0
-        
+    def load_video_title(self):
+        """The video title, the default seed of the motion styles, or an empty string before the script exists."""
+        title_file = os.path.join(self.workspace_dir, 'tmp', 'paragraphs', 'video_title.txt')
+        if not os.path.exists(title_file):
+            return ""
+        with open(title_file, 'r') as file:
+            return file.read().strip()
+
+    def output_name(self):
+        """The final render is output_video.mp4, the other profiles output_video_<profile>.mp4 next to it."""
+        return "output_video.mp4" if self.render_profile == "final" else f"output_video_{self.render_profile}.mp4"
+
+    def create_video(self, force=False):
+        """
+        Render the video, unless it was already rendered from the same images and narration.
+        :param force: Render even when the video is up to date
+        :return: The video path
+        """
+        video_output_path = os.path.join(self.videos_dir, self.output_name())
+        unit = f"video:{self.output_name()}"
+        fingerprint = self.manifest.fingerprint(self.seed, [
+            (image_name, duration, hash_file(os.path.join(self.images_dir, image_name)), hash_file(audio_path))
+            for image_name, (duration, audio_path) in self.image_audio_map.items()
+        ])
+        if not force and self.manifest.is_done(unit, fingerprint):
+            print(f"Video already rendered: {video_output_path}")
+            return video_output_path
+
+        with tracer.span("render_video", "render", profile=self.render_profile), self.profile():
+            if self.parallel_render:
+                self.render_video_segments(video_output_path)
+            else:
+                self.render_video(video_output_path)
+        if self.profile_file:
+            # The segments are rendered by worker processes, which sample their own stacks
+            merge_stacks(self.profile_file, sorted(glob.glob(f"{self.profile_file}.*.part")))
+
+        # Trimmed once the video is stitched, so the files it uses are the most recently used and can't go missing mid-render
+        self.source_cache.evict()
+        self.segment_cache.evict()
+
+        self.manifest.mark_done(unit, output=video_output_path, fingerprint=fingerprint)
+        return video_output_path
+
+    def profile(self):
+        """Sample the render's stacks into profile_file, or do nothing when profiling is off."""
+        return sample_stacks(self.profile_file) if self.profile_file else contextlib.nullcontext()
+
+    def plan_segments(self):
+        """
+        Lay out the video as one segment per paragraph, in narration order.
+        Each clip lasts 10% longer than its narration and the next one starts fade_duration seconds before it ends,
+        fading in from black over that overlap, so only the first duration * 1.1 - fade_duration seconds of a clip
+        are ever visible. Segments are cut to exactly that, and the narration starts at the sum of the previous durations.
+        :return: A list of dictionaries describing each segment
+        """
+        segments = []
+        audio_start = 0
         for image_name, (duration, audio_path) in self.image_audio_map.items():
             img_path = os.path.join(self.images_dir, image_name)
             
             if not os.path.exists(img_path) or not os.path.exists(audio_path):
                 print(f"Warning: Missing file {img_path} or {audio_path}, skipping.")
                 continue
-            
-            clip = ImageClip(img_path, duration=duration * 1.1).resize((self.video_width * 1.2, self.video_height * 1.2))
-            zoom_direction = random.choice([
-                "in", "out", 
-                "top_left_to_center", "top_right_to_center", 
-                "bottom_left_to_center", "bottom_right_to_center"
-            ])
-            zoom_clip = self.add_zoom_effect(clip, zoom_direction, duration)
-            pan_clip = crop(zoom_clip, width=self.video_width, height=self.video_height, x_center=self.video_width//2, y_center=self.video_height//2)
-            animated_clip = fadein(pan_clip, self.fade_duration).fadeout(self.fade_duration)
-            
-            audio_clip = AudioFileClip(audio_path).set_start(total_duration).set_duration(duration)
-            total_duration += duration
-            final_clip = animated_clip.set_audio(audio_clip)
-            clips.append(final_clip)
-            audio_clips.append(audio_clip)
-        
-        final_audio = CompositeAudioClip(audio_clips)
-        final_video = concatenate_videoclips(clips, method="compose", padding=-self.fade_duration).set_audio(final_audio)
+
+            segments.append({
+                "name": image_name,
+                "image_path": img_path,
+                "image_hash": hash_file(img_path),
+                "audio_path": audio_path,
+                "audio_hash": hash_file(audio_path),
+                "duration": duration,
+                "length": max(duration * 1.1 - self.fade_duration, 0.5),
+                "style": self.choose_style(image_name),
+                "seed": self.seed,
+                "audio_start": audio_start,
+                "fade_out": False,
+            })
+            audio_start += duration
+
+        if segments:
+            segments[-1]["fade_out"] = True  # The video ends with a fade to black
+        return segments
+
+    def choose_style(self, image_name):
+        """Motion style of an image: random across images and videos, but the same on every render of a video."""
+        return random.Random(f"{self.seed}:{image_name}").choice(MOTION_STYLES)
+
+    def prepare_sources(self, segments):
+        """
+        Preprocessing stage: decode every source image fitted to the canvas into the source cache,
+        skipping the ones already there, and set each segment's source_path (None when the cache is off).
+        Decoding runs on threads, since PIL releases the GIL while decoding and resampling.
+        """
+        size = (self.renderer.canvas_width, self.renderer.canvas_height)
+        with tracer.span("prepare_sources", "render"), ThreadPoolExecutor(max_workers=self.render_workers) as executor:
+            source_paths = list(executor.map(
+                lambda segment: self.source_cache.prepare(segment["image_path"], size, self.renderer.decode_source), segments
+            ))
+
+        for segment, source_path in zip(segments, source_paths):
+            segment["source_path"] = source_path
+        print("Source cache:", self.source_cache.stats())
+
+    def load_source(self, segment):
+        if segment["source_path"]:
+            return self.renderer.load_source(array=SourceCache.load(segment["source_path"]))
+        return self.renderer.load_source(segment["image_path"])
+
+    def render_video(self, video_output_path):
+        segments = self.plan_segments()
+        self.prepare_sources(segments)
+
+        clips = []
+        for segment in segments:
+            source = self.load_source(segment)
+            clips.append(self.renderer.make_clip(source, segment["style"], segment["duration"], segment["length"], fade_out=segment["fade_out"]))
+        final_video = concatenate_videoclips(clips)
+
+        audio_path = os.path.join(self.videos_dir, "narration.wav")
+        with tracer.span("write_narration", "render"):
+            self.write_narration(segments, final_video.duration, audio_path)
         
-        video_output_path = os.path.join(self.videos_dir, "output_video.mp4")
-        final_video.write_videofile(video_output_path, fps=30, codec="libx264", bitrate="5000k", audio=True)
+        # One reader for the whole narration, whatever the number of paragraphs
+        final_video = final_video.set_audio(AudioFileClip(audio_path))
+
+        with tracer.span("write_videofile", "render"):
+            final_video.write_videofile(video_output_path, fps=self.fps, codec=self.codec, bitrate=self.bitrate,
+                                        preset=self.preset, threads=self.threads, audio_codec="aac", audio_bitrate="192k")
         print(f"Video saved at: {video_output_path}")
 
-    def add_zoom_effect(self, clip, direction, duration):
-        if direction == "in":
-            return clip.resize(lambda t: 1 + 0.1 * (t / duration))
-        elif direction == "out":
-            return clip.resize(lambda t: 1.2 - 0.1 * (t / duration))
-        elif direction == "top_left_to_center":
-            return self.zoom_from_top_left_to_center(clip, duration)
-        elif direction == "top_right_to_center":
-            return self.zoom_from_top_right_to_center(clip, duration)
-        elif direction == "bottom_left_to_center":
-            return self.zoom_from_bottom_left_to_center(clip, duration)
-        elif direction == "bottom_right_to_center":
-            return self.zoom_from_bottom_right_to_center(clip, duration)
+    def render_video_segments(self, video_output_path):
+        """
+        Render the segments in parallel, one process each, then join them with ffmpeg's concat demuxer.
+        Every segment is encoded with the same settings, so they are stitched without re-encoding.
+        Segments found in the segment cache are reused as they are, so only the changed ones are rendered.
+        """
+        segments = self.plan_segments()
+        if not segments:
+            raise ValueError("No image and narration pairs to render.")
+        os.makedirs(self.segments_dir, exist_ok=True)
 
-    def zoom_from_top_left_to_center(self, clip, duration):
-        return clip.resize(lambda t: 1 + 0.1 * (t / duration)).set_position(lambda t: (0 + (self.video_width // 2) * (t / duration), 0))
+        tasks = []
+        planned_start = 0
+        frame_start = 0
+        for index, segment in enumerate(segments):
+            # A segment's frame count only depends on its own length, so an edit earlier in the video doesn't change
+            # its cache key. The rounding is absorbed when placing the narration: every paragraph keeps its offset from
+            # the start of its segment on the frame timeline, so picture and narration never drift apart
+            frames = max(1, round(segment["length"] * self.fps))
+            segment["audio_start"] += frame_start / self.fps - planned_start
+            planned_start += segment["length"]
+            frame_start += frames
+            tasks.append({
+                **segment,
+                "frames": frames,
+                "width": self.video_width,
+                "height": self.video_height,
+                "canvas_scale": 1.2,
+                "fade_duration": self.fade_duration,
+                "fps": self.fps,
+                "codec": self.codec,
+                "bitrate": self.bitrate,
+                "preset": self.preset,
+                "trace_origin": tracer.origin,
+                "profile_file": f"{self.profile_file}.{index:03d}.part" if self.profile_file else None,
+            })
 
-    def zoom_from_top_right_to_center(self, clip, duration):
-        return clip.resize(lambda t: 1 + 0.1 * (t / duration)).set_position(lambda t: (self.video_width - (self.video_width // 2) * (t / duration), 0))
+        pending = []
+        for index, task in enumerate(tasks):
+            cached_path, cached = self.segment_cache.lookup(task)
+            task["output_path"] = cached_path or os.path.join(self.segments_dir, f"segment_{index:03d}.mp4")
+            if not cached:
+                pending.append(task)
+        print("Segment cache:", self.segment_cache.stats())
 
-    def zoom_from_bottom_left_to_center(self, clip, duration):
-        return clip.resize(lambda t: 1 + 0.1 * (t / duration)).set_position(lambda t: (0 + (self.video_width // 2) * (t / duration), self.video_height - (self.video_height // 2) * (t / duration)))
+        if pending:
+            self.prepare_sources(pending)
+            print(f"Rendering {len(pending)} of {len(tasks)} segment(s) with {min(self.render_workers, len(pending))} process(es)...")
+            with tracer.span("render_segments", "render", segments=len(pending)):
+                # Spawned rather than forked: the pipeline renders from a thread while other threads may hold locks
+                with ProcessPoolExecutor(max_workers=min(self.render_workers, len(pending)), mp_context=multiprocessing.get_context("spawn")) as executor:
+                    for spans in executor.map(render_segment, pending):
+                        tracer.merge(spans, "render_worker")
+        segment_paths = [task["output_path"] for task in tasks]
 
-    def zoom_from_bottom_right_to_center(self, clip, duration):
-        return clip.resize(lambda t: 1 + 0.1 * (t / duration)).set_position(lambda t: (self.video_width - (self.video_width // 2) * (t / duration), self.video_height - (self.video_height // 2) * (t / duration)))
+        # The narration is laid out on the exact frame timeline of the segments
+        video_duration = sum(task["frames"] for task in tasks) / self.fps
+        audio_path = os.path.join(self.segments_dir, "narration.wav")
+        with tracer.span("write_narration", "render"):
+            self.write_narration(segments, video_duration, audio_path)
 
+        with tracer.span("stitch_segments", "render"):
+            self.stitch(segment_paths, audio_path, video_output_path)
+        print(f"Video saved at: {video_output_path}")
+
+    def decode_pcm(self, audio_path):
+        """Decode an audio file to 16-bit stereo PCM at audio_rate with ffmpeg."""
+        return subprocess.run([
+            FFMPEG_BINARY, "-loglevel", "error", "-i", audio_path,
+            "-f", "s16le", "-ac", "2", "-ar", str(self.audio_rate), "-",
+        ], capture_output=True, check=True).stdout
+
+    def write_narration(self, segments, video_duration, audio_path):
+        """
+        Mix the narration once into a single PCM track as long as the video: every paragraph starts at its
+        audio_start and is cut to its duration, and the rest is silence.
+        The export then reads one file, instead of summing one decoder per paragraph chunk by chunk.
+        Narration past the end of the video is cut off, as CompositeAudioClip did.
+        """
+        frame_size = 4  # 16-bit stereo
+        track = bytearray(round(video_duration * self.audio_rate) * frame_size)
+
+        for segment in segments:
+            # Offsets in samples, computed from the absolute start so rounding never accumulates
+            start = round(segment["audio_start"] * self.audio_rate) * frame_size
+            if start >= len(track):
+                continue
+            length = round(segment["duration"] * self.audio_rate) * frame_size
+            pcm = self.decode_pcm(segment["audio_path"])[:min(length, len(track) - start)]
+            track[start:start + len(pcm)] = pcm
+
+        with wave.open(audio_path, "wb") as file:
+            file.setnchannels(2)
+            file.setsampwidth(2)
+            file.setframerate(self.audio_rate)
+            file.writeframes(track)
+
+    def stitch(self, segment_paths, audio_path, video_output_path):
+        """Concatenate the segment files without re-encoding them and mux the narration, encoded once to AAC."""
+        list_path = os.path.join(self.segments_dir, "segments.txt")
+        with open(list_path, "w") as file:
+            for path in segment_paths:
+                file.write(f"file '{os.path.abspath(path)}'\n")
+
+        subprocess.run([
+            FFMPEG_BINARY, "-y", "-loglevel", "error",
+            "-f", "concat", "-safe", "0", "-i", list_path,
+            "-i", audio_path,
+            "-map", "0:v:0", "-map", "1:a:0", "-c:v", "copy", "-c:a", "aac", "-b:a", "192k", "-movflags", "+faststart",
+            video_output_path,
+        ], check=True)
+
+# python src/video_editor.py [profile] renders the current video; "benchmark" renders it with every profile,
+# from scratch: without the source and segment caches, which would otherwise serve every run after the first
 if __name__ == "__main__":
-    video_editor = VideoEditor()
-    video_editor.create_video()
+    argument = sys.argv[1] if len(sys.argv) > 1 else "final"
+    if argument != "benchmark":
+        VideoEditor(render_profile=argument).create_video()
+    else:
+        wall_times = {}
+        for render_profile in RENDER_PROFILES:
+            start = time.perf_counter()
+            VideoEditor(render_profile=render_profile, use_source_cache=False, use_segment_cache=False).create_video(force=True)
+            wall_times[render_profile] = time.perf_counter() - start
+
+        for render_profile, wall_time in wall_times.items():
+            print(f"{render_profile:>6}: {wall_time:6.1f}s ({wall_times['final'] / wall_time:.1f}x faster than final)")
@@ -0,0 +1,111 @@
+import os
+import time
+import sqlite3
+import threading
+from datetime import datetime
+import numpy as np
+
+class VideoStatsStore:
+    def __init__(self, db_file=None):
+        """
+        History of the view counts of the reference channels' videos, one row per video and sample time.
+        Each run appends its samples, so view velocity and acceleration come from the stored history
+        instead of re-fetching it.
+        :param db_file: SQLite database file (shared by every workspace and process)
+        """
+        self.db_file = db_file or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tmp', 'cache', 'video_stats.sqlite')
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_file)), exist_ok=True)
+        self.connection = sqlite3.connect(self.db_file, timeout=30, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS videos ("
+                "video_id TEXT PRIMARY KEY, channel_id TEXT, published REAL)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS video_stats ("
+                "video_id TEXT NOT NULL, fetched REAL NOT NULL, views INTEGER NOT NULL, "
+                "PRIMARY KEY (video_id, fetched)) WITHOUT ROWID"
+            )
+
+    @staticmethod
+    def parse_time(value):
+        """Convert an API timestamp (e.g., "2024-05-01T12:00:00Z") to epoch seconds."""
+        if not value:
+            return None
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+    def record(self, video_details):
+        """
+        Append one sample per video. A sample already stored (same video and fetch time, e.g., served from the
+        metadata cache) is ignored, so repeated runs don't invent flat segments in the history.
+        :param video_details: Dictionaries with video_id, channel_id, views, published_at and fetched
+        """
+        now = time.time()
+        videos = [
+            (video["video_id"], video.get("channel_id"), self.parse_time(video.get("published_at")))
+            for video in video_details if video.get("video_id")
+        ]
+        samples = [
+            (video["video_id"], video.get("fetched") or now, int(video.get("views") or 0))
+            for video in video_details if video.get("video_id")
+        ]
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT INTO videos (video_id, channel_id, published) VALUES (?, ?, ?) "
+                "ON CONFLICT (video_id) DO UPDATE SET channel_id = COALESCE(excluded.channel_id, channel_id), "
+                "published = COALESCE(excluded.published, published)",
+                videos,
+            )
+            self.connection.executemany("INSERT OR IGNORE INTO video_stats (video_id, fetched, views) VALUES (?, ?, ?)", samples)
+
+    def trends(self):
+        """
+        Compute the current view velocity of every stored video and how much it changed since the previous sample,
+        in one vectorized pass over the whole table.
+        Videos with a single sample use their lifetime average (views since publication) as the previous velocity.
+        :return: A dictionary of video ID -> {"views", "velocity", "delta"}, velocities in views per hour
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT s.video_id, s.fetched, s.views, v.published FROM video_stats s "
+                "LEFT JOIN videos v ON v.video_id = s.video_id"
+            ).fetchall()
+        if not rows:
+            return {}
+
+        ids, fetched, views, published = zip(*rows)
+        video_ids, codes = np.unique(np.array(ids), return_inverse=True)
+        fetched = np.array(fetched, dtype=np.float64)
+        views = np.array(views, dtype=np.float64)
+        published = np.array([np.nan if value is None else value for value in published], dtype=np.float64)
+
+        # Sort by video, then by time, and locate the last three samples of every video
+        order = np.lexsort((fetched, codes))
+        codes, fetched, views, published = codes[order], fetched[order], views[order], published[order]
+        last = np.append(np.flatnonzero(np.diff(codes)), len(codes) - 1)
+        first = np.append(0, last[:-1] + 1)
+        count = last - first + 1
+        prev = np.maximum(last - 1, first)
+        prev2 = np.maximum(last - 2, first)
+
+        def rate(later, earlier):
+            return (views[later] - views[earlier]) / np.maximum(fetched[later] - fetched[earlier], 1.0) * 3600
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            # Lifetime average up to a sample: views since publication
+            lifetime = lambda index: views[index] / np.maximum(fetched[index] - published[index], 3600.0) * 3600
+
+            velocity = np.where(count >= 2, rate(last, prev), lifetime(last))
+            previous = np.where(count >= 3, rate(prev, prev2), np.where(count == 2, lifetime(prev), np.nan))
+            delta = velocity - previous
+
+        return {
+            video_id: {
+                "views": int(views[last[index]]),
+                "velocity": None if np.isnan(velocity[index]) else float(velocity[index]),
+                "delta": None if np.isnan(delta[index]) else float(delta[index]),
+            }
+            for index, video_id in enumerate(video_ids.tolist())
+        }
@@ -1,14 +1,102 @@
+import time
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from rate_limiter import get_rate_limiter
+from metadata_cache import MetadataCache
+from video_stats import VideoStatsStore
+from metrics import metrics
+
+# Quota units charged by the YouTube Data API for one call of each endpoint
+QUOTA_COSTS = {
+    "search": 100,
+    "channels": 1,
+    "videos": 1,
+    "playlistItems": 1,
+}
 
 class YoutubeRetriever:
-    def __init__(self, api_key):
+    def __init__(self, api_key, max_workers=8, use_cache=True):
         """
         Initializes the YoutubeRetriever with the provided YouTube API key.
         :param api_key: YouTube API key
+        :param max_workers: Maximum number of concurrent API lookups
+        :param use_cache: Set to False to bypass the metadata cache
         """
         self.api_key = api_key
-        self.base_search_url = "https://www.googleapis.com/youtube/v3/search"
-        self.base_video_url = "https://www.googleapis.com/youtube/v3/videos"
+        self.base_url = "https://www.googleapis.com/youtube/v3"
+        self.limiter = get_rate_limiter("youtube")
+        self.max_workers = max_workers
+
+        # Pooled connections shared by every lookup, sized for the concurrent workers
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers))
+
+        self.cache = MetadataCache(enabled=use_cache)
+        self.stats_store = VideoStatsStore()
+        self.quota_used = 0
+        self.quota_by_endpoint = {}
+        self.lock = threading.Lock()
+
+    def api_get(self, endpoint, params, kind=None, key=None):
+        """
+        GET an API endpoint within the rate limits and charge its quota cost.
+        When kind and key are given, a fresh cached response is returned without calling the API,
+        and an expired one is revalidated with its ETag.
+        :param endpoint: Endpoint name (e.g., "channels", "videos")
+        :param kind: Cache kind of the response (see metadata_cache.DEFAULT_TTLS)
+        :param key: Cache key of the response
+        :return: The decoded JSON response
+        """
+        cost = QUOTA_COSTS.get(endpoint, 1)
+        headers = {}
+        cached = None
+        if kind:
+            cached, etag, fresh = self.cache.lookup(kind, key)
+            if cached is not None and fresh:
+                self.cache.record("hit", cost)
+                metrics.cached("script", "youtube", units=cost)
+                return cached
+            if cached is not None and etag:
+                headers["If-None-Match"] = etag
+
+        with metrics.measure("script", "youtube", units=cost):
+            response = self.limiter.call(self.session.get, f"{self.base_url}/{endpoint}",
+                                         params={**params, "key": self.api_key}, headers=headers)
+
+            with self.lock:
+                self.quota_used += cost
+                self.quota_by_endpoint[endpoint] = self.quota_by_endpoint.get(endpoint, 0) + cost
+
+            if kind and response.status_code == 304:
+                self.cache.touch(kind, key)
+                self.cache.record("revalidated")
+                return cached
+
+            response.raise_for_status()  # Raise exception for HTTP errors
+            data = response.json()
+        if kind:
+            self.cache.record("miss")
+            self.cache.store(kind, key, data, response.headers.get("ETag") or data.get("etag"))
+        return data
+
+    def get_channel_id(self, handle):
+        """
+        Resolve one handle with the exact channels.list lookup (1 quota unit) instead of a fuzzy search (100 units).
+        :return: The channel ID, or None if the handle doesn't exist
+        """
+        try:
+            data = self.api_get("channels", {"part": "id", "forHandle": handle}, kind="channel_id", key=handle.lower())
+        except requests.exceptions.RequestException as e:
+            print(f"Error fetching channel ID for handle: {handle} - {e}")
+            return None
+
+        if data.get("items"):
+            return data["items"][0]["id"]
+
+        print(f"No channel found for handle: {handle}")
+        return None
 
     def get_channel_ids(self, handles):
         """
@@ -16,38 +104,154 @@ class YoutubeRetriever:
         :param handles: A list of YouTube handles (e.g., ["@HFYVengeance", "@EpicSpaceChronicles"])
         :return: A dictionary where keys are handles and values are channel IDs
         """
-        channel_ids = {}
-        for handle in handles:
-            params = {
-                "part": "snippet",
-                "type": "channel",
-                "q": f"{handle}",  # Handle to query
-                "key": self.api_key,
-            }
-            try:
-                response = requests.get(self.base_search_url, params=params)
-                response.raise_for_status()  # Raise exception for HTTP errors
-                data = response.json()
-
-                if "items" in data and data["items"]:
-                    channel_id = data["items"][0]["id"]["channelId"]
-                    channel_ids[handle] = channel_id
-                else:
-                    print(f"No channel found for handle: {handle}")
-                    channel_ids[handle] = None
-            except requests.exceptions.RequestException as e:
-                print(f"Error fetching channel ID for handle: {handle} - {e}")
-                channel_ids[handle] = None
+        if not handles:
+            return {}
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(handles))) as executor:
+            channel_ids = list(executor.map(self.get_channel_id, handles))
+
+        return dict(zip(handles, channel_ids))
 
-        return channel_ids
+    def quota_stats(self):
+        return {"quota_used": self.quota_used, "by_endpoint": dict(self.quota_by_endpoint), "cache": self.cache.stats()}
 
-    def get_video_details(self, channel_ids, max_results=10):
+    def get_video_details(self, channel_ids, max_results=10, use_uploads_playlist=True):
         """
         Retrieves video details (title and view count) for a list of channel IDs.
         :param channel_ids: A list of channel IDs
         :param max_results: Number of videos to fetch per channel
+        :param use_uploads_playlist: Read the channels' uploads playlists (1 unit per page) instead of search.list (100 units per channel)
         :return: A list of dictionaries with video details (title and views)
         """
+        channel_ids = [channel_id for channel_id in channel_ids if channel_id]
+        if use_uploads_playlist:
+            return list(self.iter_video_details(channel_ids, max_results))
+        return self.search_video_details(channel_ids, max_results)
+
+    def add_trends(self, video_details):
+        """
+        Store this run's view counts in the local history and annotate every video with its view velocity
+        (views per hour) and the change of that velocity since the previous sample (delta).
+        :return: The video details, most accelerating first
+        """
+        self.stats_store.record(video_details)
+        trends = self.stats_store.trends()
+        for video in video_details:
+            trend = trends.get(video.get("video_id"), {})
+            video["velocity"] = trend.get("velocity")
+            video["delta"] = trend.get("delta")
+
+        return sorted(video_details, key=lambda video: video["delta"] if video["delta"] is not None else float("-inf"), reverse=True)
+
+    @staticmethod
+    def uploads_playlist_id(channel_id):
+        """Every channel's uploads playlist ID is its channel ID with the "UC" prefix replaced by "UU"."""
+        return "UU" + channel_id[2:]
+
+    def iter_channel_video_ids(self, channel_id, max_results=None):
+        """
+        Lazily page through a channel's uploads playlist, newest first.
+        A page is only requested once the previous one has been consumed.
+        :param max_results: Stop after this many video IDs (None for the whole playlist)
+        :return: A generator of video IDs
+        """
+        params = {
+            "part": "contentDetails",
+            "playlistId": self.uploads_playlist_id(channel_id),
+            "maxResults": 50,
+        }
+        count = 0
+        while True:
+            if max_results is not None:
+                params["maxResults"] = min(50, max_results - count)
+            data = self.api_get("playlistItems", params, kind="playlist_page",
+                                key=f"{params['playlistId']}:{params.get('pageToken', '')}:{params['maxResults']}")
+            for item in data.get("items", []):
+                yield item["contentDetails"]["videoId"]
+                count += 1
+                if max_results is not None and count >= max_results:
+                    return
+
+            page_token = data.get("nextPageToken")
+            if not page_token:
+                return
+            params = {**params, "pageToken": page_token}
+
+    def iter_video_details(self, channel_ids, max_results=None, batch_size=50):
+        """
+        Lazily yield the details of the recent videos of every channel.
+        Statistics are fetched with one videos.list call per batch_size IDs, batched across channels.
+        :param max_results: Number of videos per channel (None for all of them)
+        :return: A generator of dictionaries with video details (title and views)
+        """
+        pending = []
+
+        def fetch_batch(batch):
+            # Videos are cached one by one, since batches are made of different IDs from run to run. For the same reason
+            # they aren't revalidated: a videos.list ETag covers a whole batch, so expired videos are fetched again
+            videos = {}
+            for video_id, _ in batch:
+                video, _, fresh = self.cache.lookup("video", video_id)
+                if video is not None and fresh:
+                    videos[video_id] = video
+
+            missing = [video_id for video_id, _ in batch if video_id not in videos]
+            if missing:
+                video_data = self.api_get("videos", {"part": "snippet,statistics", "id": ",".join(missing)})
+                fetched = time.time()
+                for video in video_data.get("items", []):
+                    video["fetched"] = fetched  # Sample time of the statistics, kept when served from the cache
+                    self.cache.store("video", video["id"], video)
+                    videos[video["id"]] = video
+                self.cache.record("miss")
+            else:
+                self.cache.record("hit", QUOTA_COSTS["videos"])
+
+            channel_by_video = dict(batch)
+            for video_id, _ in batch:
+                video = videos.get(video_id)
+                if video is None:
+                    continue  # Deleted or private
+                yield {
+                    "video_id": video_id,
+                    "title": video["snippet"]["title"],
+                    "views": video["statistics"].get("viewCount", "0"),
+                    "channel_id": channel_by_video.get(video_id, video["snippet"].get("channelId")),
+                    "published_at": video["snippet"].get("publishedAt"),
+                    "fetched": video.get("fetched"),
+                }
+
+        def fetch_pending():
+            # A failed batch is reported and dropped on its own, so it neither counts as a channel error nor stays pending
+            nonlocal pending
+            try:
+                yield from fetch_batch(pending)
+            except requests.exceptions.RequestException as e:
+                print(f"Error fetching details of {len(pending)} video(s) - {e}")
+            finally:
+                pending = []
+
+        for channel_id in channel_ids:
+            try:
+                found = False
+                for video_id in self.iter_channel_video_ids(channel_id, max_results):
+                    found = True
+                    pending.append((video_id, channel_id))
+                    if len(pending) >= batch_size:
+                        yield from fetch_pending()
+
+                if not found:
+                    print(f"No videos found for channel ID: {channel_id}")
+            except requests.exceptions.RequestException as e:
+                print(f"Error listing the videos of channel ID: {channel_id} - {e}")
+
+        if pending:
+            yield from fetch_pending()
+
+    def search_video_details(self, channel_ids, max_results=10):
+        """
+        Retrieves video details through search.list (100 quota units per channel, at most 50 videos per channel).
+        """
         video_details = []
 
         for channel_id in channel_ids:
@@ -59,11 +263,8 @@ class YoutubeRetriever:
                     "maxResults": max_results,
                     "order": "date",  # Most recent videos
                     "type": "video",
-                    "key": self.api_key,
                 }
-                search_response = requests.get(self.base_search_url, params=search_params)
-                search_response.raise_for_status()
-                search_data = search_response.json()
+                search_data = self.api_get("search", search_params)
                 
                 video_ids = [item["id"]["videoId"] for item in search_data.get("items", [])]
 
@@ -75,16 +276,17 @@ class YoutubeRetriever:
                 video_params = {
                     "part": "snippet,statistics",
                     "id": ",".join(video_ids),
-                    "key": self.api_key,
                 }
-                video_response = requests.get(self.base_video_url, params=video_params)
-                video_response.raise_for_status()
-                video_data = video_response.json()
+                video_data = self.api_get("videos", video_params)
 
                 for video in video_data.get("items", []):
-                    title = video["snippet"]["title"]
-                    views = video["statistics"].get("viewCount", "0")
-                    video_details.append({"title": title, "views": views, "channel_id": channel_id})
+                    video_details.append({
+                        "video_id": video["id"],
+                        "title": video["snippet"]["title"],
+                        "views": video["statistics"].get("viewCount", "0"),
+                        "channel_id": channel_id,
+                        "published_at": video["snippet"].get("publishedAt"),
+                    })
 
             except requests.exceptions.RequestException as e:
                 print(f"Error fetching video details for channel ID: {channel_id} - {e}")
@@ -6,20 +6,32 @@ from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from googleapiclient.http import MediaFileUpload
 from tqdm import tqdm
+from run_manifest import get_run_manifest
+from build_graph import hash_file
+from metrics import metrics
+
+# Quota units charged by the YouTube Data API for each upload call
+QUOTA_COSTS = {
+    "videos.insert": 1600,
+    "thumbnails.set": 50,
+}
 
 class YouTubeUploader:
-    def __init__(self, client_secrets_file, api_service_name="youtube", api_version="v3", scopes=["https://www.googleapis.com/auth/youtube.upload"]):
+    def __init__(self, client_secrets_file, api_service_name="youtube", api_version="v3", scopes=["https://www.googleapis.com/auth/youtube.upload"], manifest=None, workspace_dir=None):
         self.client_secrets_file = client_secrets_file
         self.api_service_name = api_service_name
         self.api_version = api_version
         self.scopes = scopes
         self.credentials = None
         self.service = None
+        self.workspace_dir = workspace_dir or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+        self.token_file = os.path.join(self.workspace_dir, "token.pickle")  # One OAuth token per workspace/channel
+        self.manifest = manifest or get_run_manifest(os.path.join(self.workspace_dir, 'tmp', 'manifest.json'))  # A video is never uploaded twice
         self.authenticate()
 
     def authenticate(self):
-        if os.path.exists("token.pickle"):
-            with open("token.pickle", "rb") as token:
+        if os.path.exists(self.token_file):
+            with open(self.token_file, "rb") as token:
                 self.credentials = pickle.load(token)
 
         if not self.credentials or not self.credentials.valid:
@@ -29,12 +41,35 @@ class YouTubeUploader:
                 flow = InstalledAppFlow.from_client_secrets_file(self.client_secrets_file, self.scopes)
                 self.credentials = flow.run_local_server(port=0)
 
-            with open("token.pickle", "wb") as token:
+            with open(self.token_file, "wb") as token:
                 pickle.dump(self.credentials, token)
 
         self.service = build(self.api_service_name, self.api_version, credentials=self.credentials)
 
     def upload_video(self, video_file, title, description, category="22", privacy="public", thumbnail_file=None):
+        unit = f"upload:{os.path.basename(video_file)}"
+        fingerprint = self.manifest.fingerprint(hash_file(video_file), title, description, category, privacy)
+        record = self.manifest.get(unit, fingerprint)
+        if record:
+            response = record["result"]
+            print(f"Video already uploaded! Video ID: {response['id']}")
+        else:
+            response = self.upload_media(video_file, title, description, category, privacy)
+            self.manifest.mark_done(unit, fingerprint=fingerprint, result=response)
+
+        video_id = response['id']
+
+        # Upload thumbnail if provided
+        if thumbnail_file and os.path.exists(thumbnail_file):
+            thumbnail_unit = f"thumbnail:{video_id}"
+            thumbnail_fingerprint = self.manifest.fingerprint(hash_file(thumbnail_file))
+            if not self.manifest.is_done(thumbnail_unit, thumbnail_fingerprint):
+                self.upload_thumbnail(video_id, thumbnail_file)
+                self.manifest.mark_done(thumbnail_unit, fingerprint=thumbnail_fingerprint)
+        
+        return response
+
+    def upload_media(self, video_file, title, description, category, privacy):
         media = MediaFileUpload(video_file, chunksize=256 * 1024, resumable=True, mimetype="video/*")
         request = self.service.videos().insert(
             part="snippet,status",
@@ -52,22 +87,19 @@ class YouTubeUploader:
         )
         
         response = None
-        with tqdm(total=100, unit="%", desc="Uploading video", dynamic_ncols=True) as pbar:
-            while response is None:
-                status, response = request.next_chunk()
-                if status:
-                    progress = int(status.progress() * 100)
-                    pbar.n = progress
-                    pbar.last_print_n = progress
-                    pbar.update(0)
+        with metrics.measure("upload", "youtube", units=QUOTA_COSTS["videos.insert"], bytes=os.path.getsize(video_file)):
+            with tqdm(total=100, unit="%", desc="Uploading video", dynamic_ncols=True) as pbar:
+                while response is None:
+                    status, response = request.next_chunk()
+                    if status:
+                        progress = int(status.progress() * 100)
+                        pbar.n = progress
+                        pbar.last_print_n = progress
+                        pbar.update(0)
 
         video_id = response['id']
         print(f"\nUpload complete! Video ID: {video_id}")
         
-        # Upload thumbnail if provided
-        if thumbnail_file and os.path.exists(thumbnail_file):
-            self.upload_thumbnail(video_id, thumbnail_file)
-        
         return response
 
     def upload_thumbnail(self, video_id, thumbnail_file):
@@ -78,7 +110,8 @@ class YouTubeUploader:
             videoId=video_id,
             media_body=MediaFileUpload(thumbnail_file, mimetype='image/jpeg')
         )
-        response = request.execute()
+        with metrics.measure("upload", "youtube", units=QUOTA_COSTS["thumbnails.set"], bytes=os.path.getsize(thumbnail_file)):
+            response = request.execute()
         print(f"Thumbnail uploaded successfully for Video ID: {video_id}")
         return response
 
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules under src/ import each other by their flat names, as when they run as scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
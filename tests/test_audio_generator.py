@@ -0,0 +1,17 @@
+import pytest
+
+AudioGenerator = pytest.importorskip("audio_generator").AudioGenerator
+
+def test_split_ssml_batch():
+    answer = (
+        "Here is the SSML:\n"
+        "[[PARAGRAPH 1]]\n<speak>One</speak>\n"
+        "[[PARAGRAPH 3]]\n```xml\n<speak>Three<break time='1s'/></speak>\n```\n"
+        "[[PARAGRAPH 2]]\n<speak>Two<emphasis></speak>\n"   # Malformed
+        "[[PARAGRAPH 9]]\n<speak>Nine</speak>"              # Out of range
+    )
+    assert AudioGenerator.split_ssml_batch(answer, 4) == ["<speak>One</speak>", None, "<speak>Three<break time='1s'/></speak>", None]
+
+def test_split_ssml_batch_without_markers_or_ssml():
+    assert AudioGenerator.split_ssml_batch("<speak>No markers</speak>", 2) == [None, None]
+    assert AudioGenerator.split_ssml_batch("[[PARAGRAPH 1]]\nNo SSML at all", 1) == [None]
@@ -0,0 +1,69 @@
+import pytest
+from build_graph import BuildGraph, BuildNode
+
+@pytest.fixture
+def files(tmp_path):
+    source = tmp_path / "source.txt"
+    source.write_text("v1")
+    return {"state": str(tmp_path / "state.json"), "source": source, "output": tmp_path / "output.txt"}
+
+@pytest.fixture
+def make_graph(files):
+    built = []
+
+    def make():
+        def write_output(deps):
+            built.append("c")
+            files["output"].write_text(deps["b"])
+            return "written"
+
+        graph = BuildGraph(files["state"])
+        graph.add(BuildNode("a", lambda deps: built.append("a") or "A", inputs=[str(files["source"])]))  # Same result whatever the source
+        graph.add(BuildNode("b", lambda deps: built.append("b") or deps["a"] + "B", deps=["a"], params={"suffix": "B"}))
+        graph.add(BuildNode("c", write_output, deps=["b"], outputs=[str(files["output"])]))
+        graph.add(BuildNode("unrelated", lambda deps: built.append("unrelated")))
+        return graph
+
+    make.built = built
+    return make
+
+def test_builds_dependencies_in_order(make_graph):
+    assert make_graph().run(targets=["c"]) == {"a": "A", "b": "AB", "c": "written"}
+    assert make_graph.built == ["a", "b", "c"]
+
+def test_skips_up_to_date_nodes(make_graph):
+    make_graph().run(targets=["c"])
+    make_graph.built.clear()
+    make_graph().run(targets=["c"])
+    assert make_graph.built == []
+
+def test_early_cutoff(make_graph, files):
+    make_graph().run(targets=["c"])
+    make_graph.built.clear()
+    files["source"].write_text("v2")
+    make_graph().run(targets=["c"])
+    assert make_graph.built == ["a"]  # Rebuilt with the same result, so its dependents are still up to date
+
+def test_forced_and_missing_outputs(make_graph, files):
+    make_graph().run(targets=["c"])
+    make_graph.built.clear()
+    files["output"].unlink()
+    make_graph().run(targets=["c"], force=["b"])
+    assert make_graph.built == ["b", "c"]
+
+def test_previous_result(make_graph):
+    graph = make_graph()
+    assert graph.previous_result("b") is None
+    graph.run(targets=["c"])
+    assert make_graph().previous_result("b") == "AB"
+
+def test_cycle(make_graph):
+    graph = make_graph()
+    graph.add(BuildNode("x", lambda deps: None, deps=["y"]))
+    graph.add(BuildNode("y", lambda deps: None, deps=["x"]))
+    with pytest.raises(RuntimeError):
+        graph.run(targets=["x"])
+
+def test_unknown_target(make_graph):
+    with pytest.raises(KeyError):
+        make_graph().run(targets=["missing"])
@@ -0,0 +1,11 @@
+import os
+from cache_eviction import evict_lru
+
+def test_evicts_least_recently_used_entries(tmp_path):
+    for age, name in enumerate(["new.npy", "old.npy", "oldest.npy", "partial.tmp"]):
+        path = tmp_path / name
+        path.write_bytes(bytes(100))
+        os.utime(path, (1_000_000 - age, 1_000_000 - age))
+
+    evict_lru(str(tmp_path), 150, lambda name: name.endswith(".npy"))
+    assert sorted(os.listdir(tmp_path)) == ["new.npy", "partial.tmp"]
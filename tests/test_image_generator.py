@@ -0,0 +1,18 @@
+import pytest
+
+ImageGenerator = pytest.importorskip("image_generator").ImageGenerator
+
+def test_parse_image_prompts_wrapped_answer():
+    answer = 'Here are the prompts:\n["A castle", "A [red] dragon"]\nEnjoy!'
+    assert ImageGenerator.parse_image_prompts(answer, 2) == ["A castle", "A [red] dragon"]
+
+@pytest.mark.parametrize("answer", [
+    '["A castle"]',                 # Count mismatch
+    "A castle, a dragon",           # No array
+    '["A castle", "A dragon"',      # Truncated
+    '["A castle", "A dragon",]',    # Invalid JSON
+    '["A castle", "  "]',           # Empty prompt
+    '["A castle", 2]',              # Not a string
+])
+def test_parse_image_prompts_rejects(answer):
+    assert ImageGenerator.parse_image_prompts(answer, 2) is None
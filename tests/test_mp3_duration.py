@@ -0,0 +1,50 @@
+import struct
+import pytest
+from mp3_duration import read_mp3_duration
+
+FRAME = bytes([0xFF, 0xFB, 0x90, 0x00]) + bytes(413)  # MPEG-1 Layer III, 128 kbps, 44.1 kHz: 417-byte frames
+FRAME_DURATION = 1152 / 44100
+
+@pytest.fixture
+def duration_of(tmp_path):
+    def read(data):
+        path = tmp_path / "audio.mp3"
+        path.write_bytes(data)
+        return read_mp3_duration(str(path))
+    return read
+
+def test_frame_walk(duration_of):
+    assert duration_of(FRAME * 100) == pytest.approx(100 * FRAME_DURATION)
+
+def test_id3v2_tag_and_leading_junk(duration_of):
+    # 128-byte ID3v2 tag (syncsafe size 0x00 0x00 0x01 0x00), then junk before the first frame
+    id3 = b"ID3" + bytes([4, 0, 0, 0, 0, 1, 0]) + bytes(128)
+    assert duration_of(id3 + b"junk" + FRAME * 100) == pytest.approx(100 * FRAME_DURATION)
+
+def test_xing_frame_count(duration_of):
+    # Xing header after the 32 bytes of stereo MPEG-1 side info: flags with the frame count, 5000 frames
+    xing = FRAME[:4] + bytes(32) + b"Xing" + struct.pack(">II", 0x1, 5000)
+    xing += bytes(len(FRAME) - len(xing))
+    assert duration_of(xing + FRAME * 10) == pytest.approx(5000 * FRAME_DURATION)
+
+def test_lame_delay_and_padding(duration_of):
+    # Info header with every optional field (frame count, byte count, TOC, quality), then a LAME tag whose bytes 21-23
+    # hold the encoder delay and padding: 116 frames less 576 + 756 samples is exactly 3 seconds at 44.1 kHz
+    info = FRAME[:4] + bytes(32) + b"Info" + struct.pack(">III", 0xF, 116, 116 * 417) + bytes(100 + 4)
+    info += b"LAME3.100" + bytes(12) + ((576 << 12) | 756).to_bytes(3, "big")
+    info += bytes(len(FRAME) - len(info))
+    assert duration_of(info + FRAME * 116) == pytest.approx(3.0)
+
+def test_trailing_tags(duration_of):
+    id3v1 = b"TAG" + bytes(125)
+    ape = b"APETAGEX" + struct.pack("<IIII", 2000, 32 + 10, 1, 0) + bytes(8)
+    assert duration_of(FRAME * 100 + id3v1) == pytest.approx(100 * FRAME_DURATION)
+    assert duration_of(FRAME * 100 + bytes(10) + ape + id3v1) == pytest.approx(100 * FRAME_DURATION)
+
+def test_invalid_frame_before_the_end(duration_of):
+    with pytest.raises(ValueError):
+        duration_of(FRAME * 50 + b"junk" + FRAME * 50)
+
+def test_no_frames(duration_of):
+    with pytest.raises(ValueError):
+        duration_of(b"no audio here" * 100)
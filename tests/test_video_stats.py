@@ -0,0 +1,37 @@
+from datetime import datetime, timezone
+import pytest
+from video_stats import VideoStatsStore
+
+HOUR = 3600.0
+PUBLISHED = 1_700_000_000.0
+PUBLISHED_AT = datetime.fromtimestamp(PUBLISHED, timezone.utc).isoformat().replace("+00:00", "Z")
+
+def sample(video_id, hours, views, with_published=True):
+    return {"video_id": video_id, "channel_id": "UC1", "views": str(views), "fetched": PUBLISHED + hours * HOUR,
+            "published_at": PUBLISHED_AT if with_published else None}
+
+@pytest.fixture
+def trends(tmp_path):
+    store = VideoStatsStore(str(tmp_path / "video_stats.sqlite"))
+    store.record([sample("one", 10, 1000), sample("two", 10, 1000), sample("three", 10, 1000), sample("unknown", 10, 1000, False)])
+    store.record([sample("two", 11, 1300), sample("three", 11, 1100)])
+    store.record([sample("three", 12, 1500), sample("three", 12, 9999)])  # Same video and time: ignored
+    yield store.trends()
+    store.connection.close()
+
+def test_one_sample(trends):
+    # Lifetime average: 1000 views in 10 hours
+    assert trends["one"] == {"views": 1000, "velocity": pytest.approx(100), "delta": None}
+
+def test_two_samples(trends):
+    # 300 views in the last hour, against the lifetime average up to the previous sample
+    assert trends["two"]["velocity"] == pytest.approx(300)
+    assert trends["two"]["delta"] == pytest.approx(200)
+
+def test_three_samples(trends):
+    assert trends["three"]["views"] == 1500
+    assert trends["three"]["velocity"] == pytest.approx(400)
+    assert trends["three"]["delta"] == pytest.approx(300)
+
+def test_no_publication_time(trends):
+    assert trends["unknown"] == {"views": 1000, "velocity": None, "delta": None}
@@ -1,5 +1,8 @@
 import sys
 import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
 
 from src.script_generator import ScriptGenerator
@@ -7,51 +10,413 @@ from src.audio_generator import AudioGenerator
 from src.image_generator import ImageGenerator
 from src.video_editor import VideoEditor
 from src.youtube_uploader import YouTubeUploader
+from rate_limiter import rate_limiters  # Same module object the generators use
+from metrics import metrics
+from tracing import tracer
+from build_graph import BuildGraph, BuildNode, hash_file
+from run_manifest import get_run_manifest
 
+PIPELINE = "graph"  # "graph" rebuilds only what changed; "steps" runs every selected step in full (and can stream steps 1-3)
+
+# Graph pipeline
+TARGETS = ["upload"]  # Nodes to build, along with everything they depend on
+FORCE = ["script"]    # Nodes rebuilt even when up to date; drop "script" to rebuild the current video after edits
+
+# Steps pipeline
 STEPS = [1, 2, 3, 4, 5]
+STREAMING = True  # Overlap steps 2 and 3 with step 1, section by section, when all three are selected
 
-if __name__ == "__main__":
-    if 1 in STEPS:
-        print("***** Step 1: Creating the video script... *****")
-        script_generator = ScriptGenerator()    
-        video_details = script_generator.retrieve_video_details()  
-
-        channel_context = script_generator.generate_channel_context(video_details)  
-        video_title = script_generator.generate_unique_video_title(video_details)  
-        
-        combined_input = f"Channel Context: {channel_context}\nVideo Title: {video_title}"  
-        script_generator.generate_video_script(combined_input)  
-
-    if 2 in STEPS:
-        print("\n***** Step 2: Generating the audio... *****")
-        audio_generator = AudioGenerator(language_code="en-US", voice_name="en-US-Neural2-I", gender="MALE")  
-        audio_generator.generate_audio_for_paragraphs()  
-
-    if 3 in STEPS:
-        print("\n***** Step 3: Generating and saving the images... *****")
-        image_generator = ImageGenerator()  
-        image_generator.generate_and_save_images()  
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+SECTION_FILES = ["intro.txt", "call_to_adventure.txt", "refusal_of_call.txt", "mentor.txt",
+                 "crossing_the_threshold.txt", "trials_and_allies.txt", "climax_and_return.txt"]
+VOICE = {"language_code": "en-US", "voice_name": "en-US-Neural2-I", "gender": "MALE"}
+BATCH_SSML = True           # One SSML request per section instead of per paragraph
+BATCH_PROMPTS = "section"   # None, "section" or "script": how image prompt requests are grouped
+
+# Every run writes tmp/trace.json (open it in https://ui.perfetto.dev); set PROFILE_RENDER to also
+# sample the render's stacks into tmp/render_profile.folded (open it in https://www.speedscope.app)
+PROFILE_RENDER = False
+
+def create_script_generator(workspace_dir=ROOT_DIR):
+    return ScriptGenerator(memory_token_limit=2000, workspace_dir=workspace_dir)
+
+def create_audio_generator(workspace_dir=ROOT_DIR):
+    return AudioGenerator(**VOICE, max_workers=4, batch_ssml=BATCH_SSML, workspace_dir=workspace_dir)
+
+def create_image_generator(workspace_dir=ROOT_DIR):
+    return ImageGenerator(batch_prompts=BATCH_PROMPTS, workspace_dir=workspace_dir)
+
+def create_video_editor(workspace_dir=ROOT_DIR):
+    profile_file = os.path.join(workspace_dir, 'tmp', 'render_profile.folded') if PROFILE_RENDER else None
+    return VideoEditor(workspace_dir=workspace_dir, profile_file=profile_file)
+
+def generate_script(script_generator, on_section=None, handles_file=None):
+    # A new script starts a new run; the manifest only tracks work done for the current one
+    get_run_manifest(os.path.join(script_generator.workspace_dir, 'tmp', 'manifest.json')).reset()
+
+    with tracer.span("retrieve_video_details", "step"):
+        video_details = script_generator.retrieve_video_details(handles_file)  
+
+    channel_context = script_generator.generate_channel_context(video_details)  
+    video_title = script_generator.generate_unique_video_title(video_details)  
+    
+    combined_input = f"Channel Context: {channel_context}\nVideo Title: {video_title}"  
+    with tracer.span("generate_video_script", "step"):
+        script_generator.generate_video_script(combined_input, on_section=on_section)  
+    print("LLM cache:", script_generator.llm_cache.stats())
+
+def run_streaming_steps(workspace_dir=ROOT_DIR, handles_file=None):
+    """
+    Run steps 1-3 as a pipeline: every section is handed to the audio and image workers
+    as soon as the script generator saves it, instead of waiting for the whole script.
+    """
+    script_generator = create_script_generator(workspace_dir)
+    audio_generator = create_audio_generator(workspace_dir)
+    image_generator = create_image_generator(workspace_dir)
+
+    audio_queue = queue.Queue()
+    image_queue = queue.Queue()
+    audio_durations = {}
+    image_prompts = {}
+    image_futures = []  # Leonardo jobs are polled together as sections arrive, and waited for once at the end
+
+    def audio_worker():
+        while (section := audio_queue.get()) is not None:
+            with tracer.span("narrate_section", "step", section=section):
+                audio_durations.update(audio_generator.narrate_sections([section]))
+
+    def image_worker():
+        while (section := image_queue.get()) is not None:
+            with tracer.span("section_images", "step", section=section):
+                section_prompts, jobs = image_generator.create_image_jobs([section])
+                image_prompts.update(section_prompts)
+                image_futures.extend(image_generator.submit_images(jobs))
+
+    def on_section(section):
+        audio_queue.put(section)
+        image_queue.put(section)
+
+    with ThreadPoolExecutor(max_workers=2) as workers:
+        audio_future = workers.submit(audio_worker)
+        image_future = workers.submit(image_worker)
+
+        try:
+            generate_script(script_generator, on_section=on_section, handles_file=handles_file)
+        finally:
+            # Let the workers drain their queues and stop
+            audio_queue.put(None)
+            image_queue.put(None)
+
+        # The thumbnail needs the title and SEO description, which exist once the script is done
+        image_futures.extend(image_generator.submit_images([image_generator.create_thumbnail_job()]))
+
+        audio_future.result()
+        image_future.result()
+
+    with tracer.span("wait_for_images", "wait"):
+        image_generator.wait_for_images(image_futures)
+
+    audio_generator.write_audio_durations(audio_durations)
+    image_generator.save_prompts_to_file(image_prompts)
+
+    print("LLM cache:", audio_generator.llm_cache.stats())
+    print("Audio cache:", audio_generator.audio_cache.stats())
+    print("LLM cache:", image_generator.llm_cache.stats())
+
+def upload_video(workspace_dir=ROOT_DIR):
+    # A workspace can upload to its own channel by providing its own credentials
+    client_secrets_file = os.path.join(workspace_dir, 'data', 'youtube_credentials.json')
+    if not os.path.exists(client_secrets_file):
+        client_secrets_file = os.path.join(ROOT_DIR, 'data', 'youtube_credentials.json')
+    uploader = YouTubeUploader(client_secrets_file, workspace_dir=workspace_dir)
+
+    video_file = os.path.join(workspace_dir, 'tmp', 'videos', 'output_video.mp4')
+    thumbnail_file = os.path.join(workspace_dir, 'tmp', 'images', 'thumbnail.jpg')
+    paragraphs_dir = os.path.join(workspace_dir, 'tmp', 'paragraphs')
+
+    with open(os.path.join(paragraphs_dir, 'video_title.txt'), 'r') as file:
+        title = file.read().strip()
+
+    with open(os.path.join(paragraphs_dir, 'seo_description.txt'), 'r') as file:
+        description = file.read().strip()
+
+    return uploader.upload_video(video_file, title, description, thumbnail_file=thumbnail_file)
+
+def lazy(factory):
+    """Create the object on first use, so nodes that are up to date never construct API clients."""
+    instance = []
+    lock = threading.Lock()
+
+    def get():
+        with lock:
+            if not instance:
+                instance.append(factory())
+        return instance[0]
+    return get
+
+def context_files(workspace_dir, names):
+    """The context files a generator may read: the workspace's own copies and the shared ones."""
+    return [os.path.join(directory, name) for directory in dict.fromkeys([workspace_dir, ROOT_DIR]) for name in names]
+
+def incremental_batch(graph, name, texts, request, inputs=()):
+    """
+    Action of a batch node: request results only for the paragraphs that aren't in the node's previous result, and reuse
+    the previous results of the others. Nothing is reused once an input file (e.g., a context file) has changed.
+    :param request: Callable mapping a list of paragraphs to the list of their results
+    """
+    def action(deps):
+        input_hashes = {path: hash_file(path) for path in inputs}
+        previous = graph.previous_result(name)
+        known = {}
+        if isinstance(previous, dict) and previous.get("inputs") == input_hashes:
+            known = dict(zip(previous["paragraphs"], previous["results"]))
+
+        missing = [text for text in dict.fromkeys(texts) if text not in known]
+        if missing:
+            print(f"{name}: requesting {len(missing)} of {len(texts)} paragraph(s)")
+            known.update(zip(missing, request(missing)))
+        return {"inputs": input_hashes, "paragraphs": texts, "results": [known[text] for text in texts]}
+    return action
+
+def build_script_graph(graph, workspace_dir=ROOT_DIR, handles_file=None):
+    paragraphs_dir = os.path.join(workspace_dir, 'tmp', 'paragraphs')
+    outputs = [os.path.join(paragraphs_dir, name) for name in SECTION_FILES + ["video_title.txt", "seo_description.txt"]]
+    inputs = [handles_file or os.path.join(workspace_dir, "handles.txt")] + context_files(workspace_dir, ["title_context.txt", "script_context.txt"])
+
+    graph.add(BuildNode("script", lambda deps: generate_script(create_script_generator(workspace_dir), handles_file=handles_file),
+                        inputs=inputs, outputs=outputs))
+
+def build_media_graph(graph, workspace_dir=ROOT_DIR):
+    """
+    Declare one audio and one image node per paragraph of the current script, and the nodes built from them.
+    With BATCH_SSML and BATCH_PROMPTS, the SSML and image prompts are requested by one node per section (or one for
+    the whole script's prompts), which only requests the paragraphs it has no result for yet. A slice node per paragraph
+    picks its element from the batch, so an edited paragraph only rebuilds its own audio and image.
+    Every image node submits to the image generator's shared Leonardo poller.
+    """
+    audio_generator = lazy(lambda: create_audio_generator(workspace_dir))
+    image_generator = lazy(lambda: create_image_generator(workspace_dir))
+
+    paragraphs_dir = os.path.join(workspace_dir, 'tmp', 'paragraphs')
+    audio_dir = os.path.join(workspace_dir, 'tmp', 'audios')
+    images_dir = os.path.join(workspace_dir, 'tmp', 'images')
+    videos_dir = os.path.join(workspace_dir, 'tmp', 'videos')
+
+    paragraphs = []  # (name, paragraph) of every paragraph, in script order
+    sections = []    # Slice of paragraphs of every section
+    for section in SECTION_FILES:
+        with open(os.path.join(paragraphs_dir, section), "r") as file:
+            section_paragraphs = file.read().split("\n\n")  # Assuming paragraphs are separated by two newlines
+
+        start = len(paragraphs)
+        paragraphs += [(f"{section.replace('.txt', '')}_paragraph_{i}", paragraph) for i, paragraph in enumerate(section_paragraphs, start=1)]
+        sections.append((section.replace('.txt', ''), slice(start, len(paragraphs))))
+
+    def add_slices(prefix, batch_node, paragraph_slice):
+        """Add a node per paragraph of a batch returning its own result; its unchanged output stops the rebuild there."""
+        return {
+            name: graph.add(BuildNode(
+                f"{prefix}:{name}",
+                lambda deps, index=index: deps[batch_node]["results"][index],
+                deps=[batch_node],
+            )).name
+            for index, (name, _) in enumerate(paragraphs[paragraph_slice])
+        }
+
+    # Batch nodes, and the slice node of every paragraph
+    ssml_slices = {}
+    if BATCH_SSML:
+        for stem, paragraph_slice in sections:
+            texts = [paragraph for _, paragraph in paragraphs[paragraph_slice]]
+            node = graph.add(BuildNode(
+                f"ssml:{stem}",
+                incremental_batch(graph, f"ssml:{stem}", texts, lambda missing: audio_generator().get_ssml_texts(missing)),
+                params={"paragraphs": texts},
+            )).name
+            ssml_slices.update(add_slices("ssml", node, paragraph_slice))
+
+    prompt_slices = {}
+    if BATCH_PROMPTS:
+        batches = sections if BATCH_PROMPTS == "section" else [("script", slice(0, len(paragraphs)))]
+        for stem, paragraph_slice in batches:
+            texts = [paragraph for _, paragraph in paragraphs[paragraph_slice]]
+            inputs = context_files(workspace_dir, ["image_context.txt"])
+            node = graph.add(BuildNode(
+                f"prompts:{stem}",
+                incremental_batch(graph, f"prompts:{stem}", texts, lambda missing: image_generator().get_image_prompts(missing), inputs),
+                inputs=inputs,
+                params={"paragraphs": texts},
+            )).name
+            prompt_slices.update(add_slices("prompt", node, paragraph_slice))
+
+    audio_nodes = []
+    image_nodes = []
+    for name, paragraph in paragraphs:
+        mp3_file_name = f"{name}.mp3"
+        image_path = os.path.join(images_dir, f"{name}.jpg")
+
+        if name in ssml_slices:
+            node = ssml_slices[name]
+            audio_action = lambda deps, paragraph=paragraph, mp3_file_name=mp3_file_name, node=node: \
+                audio_generator().narrate_paragraph(paragraph, deps[node], mp3_file_name)
+            audio_deps = [node]
+        else:
+            audio_action = lambda deps, paragraph=paragraph, mp3_file_name=mp3_file_name: \
+                audio_generator().generate_audio_for_paragraph(paragraph, mp3_file_name)
+            audio_deps = []
+
+        audio_nodes.append(graph.add(BuildNode(
+            f"audio:{name}",
+            audio_action,
+            deps=audio_deps,
+            params={"paragraph": paragraph, "voice": VOICE},
+            outputs=[os.path.join(audio_dir, mp3_file_name)],
+        )).name)
+
+        if name in prompt_slices:
+            node = prompt_slices[name]
+
+            def image_action(deps, image_path=image_path, node=node):
+                image_prompt = deps[node]
+                image_generator().generate_images([(image_prompt, image_path)])
+                return image_prompt
+
+            image_node = BuildNode(f"image:{name}", image_action, deps=[node], outputs=[image_path])
+        else:
+            image_node = BuildNode(
+                f"image:{name}",
+                lambda deps, paragraph=paragraph, image_path=image_path: image_generator().generate_image_for_paragraph(paragraph, image_path),
+                inputs=context_files(workspace_dir, ["image_context.txt"]),
+                params={"paragraph": paragraph},
+                outputs=[image_path],
+            )
+        image_nodes.append(graph.add(image_node).name)
+
+    graph.add(BuildNode(
+        "audio_durations",
+        lambda deps: audio_generator().write_audio_durations({f"{node[len('audio:'):]}.mp3": deps[node] for node in audio_nodes}),
+        deps=audio_nodes,
+        outputs=[os.path.join(audio_dir, "audio_durations.txt")],
+    ))
+
+    graph.add(BuildNode(
+        "image_prompts",
+        lambda deps: image_generator().save_prompts_to_file({node[len('image:'):]: deps[node] for node in image_nodes}),
+        deps=image_nodes,
+        outputs=[os.path.join(images_dir, "image_prompts.txt")],
+    ))
+
+    graph.add(BuildNode(
+        "thumbnail",
+        lambda deps: image_generator().generate_images([image_generator().create_thumbnail_job()]),
+        inputs=[os.path.join(paragraphs_dir, "video_title.txt"), os.path.join(paragraphs_dir, "seo_description.txt")]
+               + context_files(workspace_dir, ["thumbnail_context.txt"]),
+        outputs=[os.path.join(images_dir, "thumbnail.jpg")],
+    ))
+
+    graph.add(BuildNode(
+        "video",
+        lambda deps: create_video_editor(workspace_dir).create_video(),
+        deps=["audio_durations"] + image_nodes,
+        outputs=[os.path.join(videos_dir, "output_video.mp4")],
+    ))
+
+    graph.add(BuildNode(
+        "upload",
+        lambda deps: upload_video(workspace_dir)["id"],
+        deps=["video", "thumbnail"],
+        inputs=[os.path.join(paragraphs_dir, "video_title.txt"), os.path.join(paragraphs_dir, "seo_description.txt")],
+    ))
+
+def run_build_graph(workspace_dir=ROOT_DIR, handles_file=None, targets=None, force=None):
+    """
+    Build the targets (TARGETS by default) incrementally in a workspace.
+    The script is built first, since the paragraph nodes depend on its content.
+    """
+    targets = TARGETS if targets is None else targets
+    force = FORCE if force is None else force
+    state_file = os.path.join(workspace_dir, 'tmp', 'build_state.json')
+
+    script_graph = BuildGraph(state_file)
+    build_script_graph(script_graph, workspace_dir, handles_file)
+    with tracer.span("script graph", "step"):
+        script_graph.run(force=force)
+
+    media_graph = BuildGraph(state_file)
+    build_media_graph(media_graph, workspace_dir)
+    # Image nodes only wait on the shared Leonardo poller, so every node gets a thread and all the jobs are in flight
+    # at once, as in the steps pipeline; the rate limiters bound the calls each provider actually receives
+    media_graph.max_workers = len(media_graph.nodes)
+    with tracer.span("media graph", "step"):
+        media_graph.run(targets=targets, force=force)
+
+def run_steps(workspace_dir=ROOT_DIR, handles_file=None):
+    """
+    Run every step in STEPS in full.
+    """
+    if STREAMING and {1, 2, 3} <= set(STEPS):
+        print("***** Steps 1-3: Creating the script, audio and images (streaming)... *****")
+        with tracer.span("steps 1-3", "step"):
+            run_streaming_steps(workspace_dir, handles_file)
+
+    else:
+        if 1 in STEPS:
+            print("***** Step 1: Creating the video script... *****")
+            with tracer.span("step 1: script", "step"):
+                script_generator = create_script_generator(workspace_dir)    
+                generate_script(script_generator, handles_file=handles_file)
+
+        if 2 in STEPS:
+            print("\n***** Step 2: Generating the audio... *****")
+            with tracer.span("step 2: audio", "step"):
+                audio_generator = create_audio_generator(workspace_dir)  
+                audio_generator.generate_audio_for_paragraphs()  
+            print("LLM cache:", audio_generator.llm_cache.stats())
+            print("Audio cache:", audio_generator.audio_cache.stats())
+
+        if 3 in STEPS:
+            print("\n***** Step 3: Generating and saving the images... *****")
+            with tracer.span("step 3: images", "step"):
+                image_generator = create_image_generator(workspace_dir)  
+                image_generator.generate_and_save_images()  
+            print("LLM cache:", image_generator.llm_cache.stats())
 
     if 4 in STEPS:
         print("\n***** Step 4: Creating the video... *****")
-        video_editor = VideoEditor()
-        video_editor.create_video()  
+        with tracer.span("step 4: video", "step"):
+            video_editor = create_video_editor(workspace_dir)
+            video_editor.create_video()  
 
     if 5 in STEPS:
         print("\n***** Step 5: Uploading the video to YouTube... *****")
-        client_secrets_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'youtube_credentials.json')
-        uploader = YouTubeUploader(client_secrets_file)
-
-        video_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tmp', 'videos', 'output_video.mp4')
-        thumbnail_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tmp', 'images', 'thumbnail.jpg')
-        paragraphs_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tmp', 'paragraphs')
+        with tracer.span("step 5: upload", "step"):
+            upload_video(workspace_dir)
 
-        with open(os.path.join(paragraphs_dir, 'video_title.txt'), 'r') as file:
-            title = file.read().strip()
+def run_pipeline(workspace_dir=ROOT_DIR, handles_file=None):
+    """
+    Produce one video in workspace_dir with the configured PIPELINE.
+    Cost and latency of every external call are written to workspace_dir/tmp/metrics.json,
+    and the timeline of the run to workspace_dir/tmp/trace.json.
+    """
+    metrics.reset()
+    tracer.reset()
+    try:
+        with tracer.span("run_pipeline", "pipeline", workspace=workspace_dir):
+            if PIPELINE == "graph":
+                print("***** Building the video... *****")
+                run_build_graph(workspace_dir, handles_file)
+            else:
+                run_steps(workspace_dir, handles_file)
+    finally:
+        # Written even when a step fails, so the cost and timeline of a failed run are known too
+        report = metrics.write_summary(os.path.join(workspace_dir, 'tmp', 'metrics.json'))
+        print("Run totals:", report["totals"])
+        tracer.write(os.path.join(workspace_dir, 'tmp', 'trace.json'))
 
-        with open(os.path.join(paragraphs_dir, 'seo_description.txt'), 'r') as file:
-            description = file.read().strip()
+    for limiter in rate_limiters.values():
+        print("Rate limiter:", limiter.stats())
 
-        uploader.upload_video(video_file, title, description, thumbnail_file=thumbnail_file)
+if __name__ == "__main__":
+    run_pipeline()
 
     print("\n***** Process completed successfully! *****")